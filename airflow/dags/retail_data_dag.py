@@ -15,6 +15,9 @@ from airflow.providers.google.cloud.operators.bigquery import BigQueryExecuteQue
 from airflow.utils.dates import days_ago
 import datetime
 
+# Même réglage de compression que les générateurs pour les fichiers d'arrivée (à définir aussi dans l'environnement Airflow)
+from retail_data_tasks import landing_extension
+
 # Default arguments for DAG
 default_args = {
     'owner': 'data_engineering',
@@ -51,6 +54,18 @@ with DAG(
         -- Create dataset if it doesn't exist
         CREATE SCHEMA IF NOT EXISTS retail_data;
 
+        -- CSV loads are positional: tables created before the change log must match the new column order.
+        -- customers: modification_history is gone from the landing files
+        ALTER TABLE IF EXISTS retail_data.customers DROP COLUMN IF EXISTS modification_history;
+        -- customers_master: change_count replaces modification_history; the table is truncated and
+        -- reloaded at each master update, so it is dropped and recreated below
+        IF NOT EXISTS (
+          SELECT 1 FROM retail_data.INFORMATION_SCHEMA.COLUMNS
+          WHERE table_name = 'customers_master' AND column_name = 'change_count' AND ordinal_position = 15
+        ) THEN
+          DROP TABLE IF EXISTS retail_data.customers_master;
+        END IF;
+
         -- Create customers table
         CREATE TABLE IF NOT EXISTS retail_data.customers (
           customer_id STRING,
@@ -67,7 +82,6 @@ with DAG(
           last_modified TIMESTAMP,
           customer_segment STRING,
           is_active BOOLEAN,
-          modification_history STRING,
           _file_name STRING,
           _load_time TIMESTAMP
         )
@@ -123,7 +137,7 @@ with DAG(
           last_modified TIMESTAMP,
           customer_segment STRING,
           is_active BOOLEAN,
-          modification_history STRING,
+          change_count INT64,
           _file_name STRING,
           _load_time TIMESTAMP
         );
@@ -139,14 +153,15 @@ with DAG(
         LOAD DATA INTO retail_data.customers
         FROM FILES (
           format = 'CSV',
-          uris = ['gs://retail-data-landing-zone/customers/customers_{{ ds }}.csv'],
+          uris = ['gs://retail-data-landing-zone/customers/customers_{{ ds }}{{ params.ext }}'],
           skip_leading_rows = 1
         )
         WITH TRANSFORMATION (
-          '_file_name', 'customers_{{ ds }}.csv',
+          '_file_name', 'customers_{{ ds }}{{ params.ext }}',
           '_load_time', CURRENT_TIMESTAMP()
         );
         ''',
+        params={'ext': landing_extension('customers')},
         use_legacy_sql=False,
     )
 
@@ -157,14 +172,15 @@ with DAG(
         LOAD DATA INTO retail_data.products
         FROM FILES (
           format = 'CSV',
-          uris = ['gs://retail-data-landing-zone/products/products_{{ ds }}.csv'],
+          uris = ['gs://retail-data-landing-zone/products/products_{{ ds }}{{ params.ext }}'],
           skip_leading_rows = 1
         )
         WITH TRANSFORMATION (
-          '_file_name', 'products_{{ ds }}.csv',
+          '_file_name', 'products_{{ ds }}{{ params.ext }}',
           '_load_time', CURRENT_TIMESTAMP()
         );
         ''',
+        params={'ext': landing_extension('products')},
         use_legacy_sql=False,
     )
 
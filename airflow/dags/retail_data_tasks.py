@@ -0,0 +1,104 @@
+"""
+Retail Data Pipeline - task graph as plain data
+
+Tasks, dependencies, table schemas and source files of retail_data_dag.py,
+without any Airflow import, for the local runner (scripts/run_dag_locally.py).
+The DAG keeps its own hand-written SQL: update both when a task or a table
+changes.
+"""
+import os
+
+LANDING_BUCKET = 'retail-data-landing-zone'
+
+# Upstream tasks of each task, in execution order
+TASK_DEPENDENCIES = {
+    'generate_synthetic_data': [],
+    'create_bq_tables': ['generate_synthetic_data'],
+    'load_customers': ['create_bq_tables'],
+    'load_products': ['create_bq_tables'],
+    'load_orders': ['create_bq_tables'],
+    'update_master_table': ['load_customers', 'load_products', 'load_orders'],
+    'data_quality_checks': ['update_master_table'],
+}
+
+TABLES = {
+    'customers': {
+        'columns': [
+            ('customer_id', 'STRING'), ('company_name', 'STRING'), ('vat_number', 'STRING'),
+            ('address', 'STRING'), ('postal_code', 'STRING'), ('city', 'STRING'),
+            ('country', 'STRING'), ('email', 'STRING'), ('phone', 'STRING'),
+            ('industry', 'STRING'), ('created_at', 'TIMESTAMP'), ('last_modified', 'TIMESTAMP'),
+            ('customer_segment', 'STRING'), ('is_active', 'BOOLEAN'),
+            ('_file_name', 'STRING'), ('_load_time', 'TIMESTAMP'),
+        ],
+        'partition_by': 'last_modified',
+    },
+    'products': {
+        'columns': [
+            ('product_id', 'STRING'), ('product_name', 'STRING'), ('category', 'STRING'),
+            ('subcategory', 'STRING'), ('price', 'FLOAT64'), ('cost', 'FLOAT64'),
+            ('weight_kg', 'FLOAT64'), ('in_stock', 'BOOLEAN'), ('created_at', 'TIMESTAMP'),
+            ('_file_name', 'STRING'), ('_load_time', 'TIMESTAMP'),
+        ],
+        'partition_by': 'created_at',
+    },
+    'orders': {
+        'columns': [
+            ('order_id', 'STRING'), ('customer_id', 'STRING'), ('product_id', 'STRING'),
+            ('order_date', 'TIMESTAMP'), ('quantity', 'INT64'), ('status', 'STRING'),
+            ('payment_method', 'STRING'), ('shipping_method', 'STRING'), ('shipping_cost', 'FLOAT64'),
+            ('amount', 'FLOAT64'), ('total_amount', 'FLOAT64'),
+            ('_file_name', 'STRING'), ('_load_time', 'TIMESTAMP'),
+        ],
+        'partition_by': 'order_date',
+    },
+    'customers_master': {
+        'columns': [
+            ('customer_id', 'STRING'), ('company_name', 'STRING'), ('vat_number', 'STRING'),
+            ('address', 'STRING'), ('postal_code', 'STRING'), ('city', 'STRING'),
+            ('country', 'STRING'), ('email', 'STRING'), ('phone', 'STRING'),
+            ('industry', 'STRING'), ('created_at', 'TIMESTAMP'), ('last_modified', 'TIMESTAMP'),
+            ('customer_segment', 'STRING'), ('is_active', 'BOOLEAN'), ('change_count', 'INT64'),
+            ('_file_name', 'STRING'), ('_load_time', 'TIMESTAMP'),
+        ],
+        'partition_by': None,
+    },
+}
+
+# CREATE TABLE IF NOT EXISTS ne modifie pas les tables existantes, et les chargements CSV sont positionnels :
+# colonnes retirées après coup, et tables recréées si leurs colonnes ne suivent plus le schéma
+DROPPED_COLUMNS = [
+    ('customers', 'modification_history'),
+]
+RECREATED_TABLES = ['customers_master']
+
+# Extension des fichiers d'arrivée générés, selon le même réglage que les générateurs
+# (OBJECT_COMPRESSION_<ENTITY>, puis OBJECT_COMPRESSION) : BigQuery ne charge que du CSV brut ou gzip
+LANDING_EXTENSIONS = {'none': '.csv', 'gzip': '.csv.gz'}
+
+
+def landing_extension(entity):
+    codec = os.getenv(f'OBJECT_COMPRESSION_{entity.upper()}', os.getenv('OBJECT_COMPRESSION', 'none')).lower()
+    if codec not in LANDING_EXTENSIONS:
+        raise ValueError(f"Landing compression '{codec}' for {entity} cannot be loaded into BigQuery, expected one of {sorted(LANDING_EXTENSIONS)}")
+    return LANDING_EXTENSIONS[codec]
+
+
+# Tâches de chargement : table cible et fichier source ({ds} = date d'exécution, {ext} = landing_extension(table))
+LOADS = {
+    'load_customers': ('customers', 'customers/customers_{ds}{ext}'),
+    'load_products': ('products', 'products/products_{ds}{ext}'),
+    'load_orders': ('orders', 'orders/orders_{ds}.csv'),
+}
+
+# Le master n'est rechargé que le lundi
+MASTER_LOAD = ('customers_master', 'master/customers_master.csv')
+MASTER_LOAD_WEEKDAY = 0
+
+# Contrôles qualité : (table, colonne id, seconde colonne contrôlée, nom du compteur associé)
+QUALITY_CHECKS = [
+    ('customers', 'customer_id', 'company_name', 'missing_names'),
+    ('products', 'product_id', 'product_name', 'missing_names'),
+    ('orders', 'order_id', 'customer_id', 'missing_customer_ids'),
+]
+
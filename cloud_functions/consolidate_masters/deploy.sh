@@ -35,6 +35,11 @@ echo "Project: ${PROJECT_ID}"
 echo "Region: ${REGION}"
 echo "Bucket: ${BUCKET}"
 
+# Embarque le module partagé dans les sources déployées
+rm -rf shared
+cp -r ../shared shared
+trap 'rm -rf shared' EXIT
+
 gcloud functions deploy "${FUNCTION_NAME}" \
   --gen2 \
   --runtime=python312 \
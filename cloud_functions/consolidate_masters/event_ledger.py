@@ -0,0 +1,100 @@
+# Registre d'idempotence des événements de stockage (livraison « au moins une fois »)
+"""Ledger of processed storage events, keyed by object name and generation.
+
+Each event owns one small object, _ledger/<function>/<object name>/<generation>.json,
+read and written without touching the landing file:
+
+- a delivery claims the event by creating its entry with if_generation_match=0,
+  so only one of several concurrent deliveries wins;
+- the winner marks the entry done with the outcome, or deletes it when
+  processing failed so that a redelivery can retry;
+- a claim older than LEDGER_CLAIM_TIMEOUT_SEC (instance stopped mid-run) is
+  taken over with a conditional write on the entry's generation;
+- an entry deleted or rewritten while it is being read is read again, up to
+  CLAIM_ATTEMPTS times, after which the delivery is skipped as contended.
+
+Entries are never read back in bulk; a lifecycle rule on the _ledger/ prefix
+can expire them.
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+LEDGER_PREFIX = "_ledger"
+CLAIM_ATTEMPTS = 3
+
+
+def ledger_enabled():
+    return os.getenv("EVENT_LEDGER", "true").lower() == "true"
+
+
+def get_claim_timeout_sec():
+    # Au-delà du délai maximal d'exécution d'une Cloud Function, la réclamation est abandonnée
+    return float(os.getenv("LEDGER_CLAIM_TIMEOUT_SEC", "600"))
+
+
+def ledger_path(function_name, object_name, generation):
+    return f"{LEDGER_PREFIX}/{function_name}/{object_name}/{generation}.json"
+
+
+def _write(blob, entry, if_generation_match):
+    blob.upload_from_string(json.dumps(entry), "application/json", if_generation_match=if_generation_match)
+
+
+def claim(bucket, function_name, object_name, generation):
+    """Claim an event for processing.
+
+    Returns (blob, entry) with the new claim when this delivery owns the event,
+    or (None, entry) with the existing entry when it is done or claimed by
+    another delivery (status "contended" when it kept changing hands).
+    """
+    blob = bucket.blob(ledger_path(function_name, object_name, generation))
+    entry = {
+        "status": "in_progress",
+        "object": object_name,
+        "generation": str(generation),
+        "claimed_at": datetime.utcnow().isoformat(),
+        "claimed_ts": time.time(),
+    }
+    for _ in range(CLAIM_ATTEMPTS):
+        try:
+            _write(blob, entry, if_generation_match=0)
+            return blob, entry
+        except PreconditionFailed:
+            pass
+
+        # Entrée libérée ou réécrite entre l'écriture refusée et sa lecture : on recommence
+        existing = bucket.get_blob(blob.name)
+        if existing is None:
+            continue
+        try:
+            current = json.loads(existing.download_as_text())
+        except NotFound:
+            continue
+        if current.get("status") != "in_progress" or time.time() - current.get("claimed_ts", 0) <= get_claim_timeout_sec():
+            return None, current
+        taken = dict(entry, taken_over_from=current.get("claimed_at"))
+        try:
+            _write(blob, taken, if_generation_match=existing.generation)
+            return blob, taken
+        except PreconditionFailed:
+            continue
+    return None, {"status": "contended", "object": object_name, "generation": str(generation)}
+
+
+def complete(blob, entry, result):
+    """Mark a claimed event as processed; later deliveries are skipped."""
+    entry = dict(entry)
+    entry.update({"status": "done", "completed_at": datetime.utcnow().isoformat(), "action": result.get("action")})
+    _write(blob, entry, if_generation_match=blob.generation)
+
+
+def release(blob):
+    """Drop a claim after a failure so that a redelivery processes the event again."""
+    try:
+        blob.delete(if_generation_match=blob.generation)
+    except (NotFound, PreconditionFailed):
+        pass
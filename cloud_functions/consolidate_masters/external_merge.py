@@ -0,0 +1,177 @@
+# Mastering hors mémoire : tri externe par clé puis fusion en flux
+import pandas as pd
+import contextlib
+import csv
+import heapq
+import itertools
+import os
+from collections import deque
+from operator import itemgetter
+
+from shared import changelog
+
+# Facteur entre la taille CSV d'un bloc et son empreinte en DataFrame
+PANDAS_MEMORY_FACTOR = 4
+# Nombre maximal de runs fusionnés en une passe (fichiers ouverts simultanément)
+MAX_MERGE_FANIN = 64
+
+
+def read_header(path):
+    with open(path, newline="") as f:
+        return next(csv.reader(f), [])
+
+
+def rows_per_run(path, memory_cap_bytes, sample_lines=1000):
+    """Number of rows a sorted run may hold so that sorting it stays under the cap."""
+    with open(path, newline="") as f:
+        f.readline()
+        sample = [line for line in itertools.islice(f, sample_lines)]
+    avg_row_bytes = max(1, sum(len(line) for line in sample) / max(len(sample), 1))
+    return max(1000, int(memory_cap_bytes / (avg_row_bytes * PANDAS_MEMORY_FACTOR)))
+
+
+def sort_into_runs(path, id_col, run_rows, out_dir, prefix):
+    """Cut a CSV file into runs of at most run_rows rows, each sorted by id_col and spilled to disk."""
+    runs = []
+    for n, chunk in enumerate(pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=run_rows)):
+        run_path = os.path.join(out_dir, f"{prefix}-run-{n:05d}.csv")
+        chunk.sort_values(by=id_col, kind="mergesort").to_csv(run_path, index=False)
+        runs.append(run_path)
+    return runs
+
+
+@contextlib.contextmanager
+def open_sorted_rows(run_paths, key_index):
+    """Rows of all runs in key order (runs keep their relative order on equal keys)."""
+    with contextlib.ExitStack() as stack:
+        readers = []
+        for run_path in run_paths:
+            reader = csv.reader(stack.enter_context(open(run_path, newline="")))
+            next(reader, None)
+            readers.append(reader)
+        yield heapq.merge(*readers, key=itemgetter(key_index))
+
+
+def reduce_runs(run_paths, header, key_index, out_dir, prefix):
+    """Merge runs in passes until at most MAX_MERGE_FANIN remain."""
+    level = 0
+    while len(run_paths) > MAX_MERGE_FANIN:
+        merged = []
+        for n in range(0, len(run_paths), MAX_MERGE_FANIN):
+            group = run_paths[n:n + MAX_MERGE_FANIN]
+            merged_path = os.path.join(out_dir, f"{prefix}-merge{level}-{n // MAX_MERGE_FANIN:05d}.csv")
+            with open(merged_path, "w", newline="") as f, open_sorted_rows(group, key_index) as rows:
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerow(header)
+                writer.writerows(rows)
+            for run_path in group:
+                os.remove(run_path)
+            merged.append(merged_path)
+        run_paths = merged
+        level += 1
+    return run_paths
+
+
+def sorted_runs(path, id_col, memory_cap_bytes, out_dir, prefix):
+    header = read_header(path)
+    if id_col not in header:
+        raise ValueError(f"Key column {id_col} not found in {os.path.basename(path)}")
+    key_index = header.index(id_col)
+    runs = sort_into_runs(path, id_col, rows_per_run(path, memory_cap_bytes), out_dir, prefix)
+    return header, key_index, reduce_runs(runs, header, key_index, out_dir, prefix)
+
+
+class ChangeTracker:
+    """Field-level changes of the keys kept from the previous master, written as change-log rows."""
+
+    def __init__(self, old_header, new_header, writer, ts, source_file):
+        self.count_index = old_header.index(changelog.CHANGE_COUNT_COLUMN) if changelog.CHANGE_COUNT_COLUMN in old_header else None
+        self.fields = [(name, old_header.index(name), new_header.index(name)) for name in changelog.tracked_columns(old_header, new_header)]
+        self.writer = writer
+        self.ts = ts
+        self.source_file = source_file
+        self.changes = 0
+
+    def values(self, old_row):
+        # Ligne de l'ancien master sans son compteur, comparable à une ligne du fichier d'arrivée
+        if self.count_index is None:
+            return old_row
+        return old_row[:self.count_index] + old_row[self.count_index + 1:]
+
+    def change_count(self, key, old_row, new_row):
+        """Record the changes of one key and return its new change_count."""
+        if old_row is None:
+            return 0
+        rows = changelog.diff_rows(key, self.fields, old_row, new_row, self.ts, self.source_file)
+        self.writer.writerows(rows)
+        self.changes += len(rows)
+        previous = old_row[self.count_index] if self.count_index is not None else ""
+        return int(previous or 0) + len(rows)
+
+
+def merge_sorted(old_rows, new_rows, old_key, new_key, same_columns, writer, tracker=None):
+    """Sort-merge join of two key-ordered streams; writes the new rows and counts changes by key.
+
+    With a tracker, each written row gets its change_count appended and field changes are logged.
+    """
+    counts = {"rows": 0, "old_rows": 0, "inserted": 0, "updated": 0, "deleted": 0}
+    values = tracker.values if tracker is not None else (lambda row: row)
+    old_groups = itertools.groupby(old_rows, key=itemgetter(old_key))
+    new_groups = itertools.groupby(new_rows, key=itemgetter(new_key))
+    old = next(old_groups, None)
+    new = next(new_groups, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            counts["deleted"] += 1
+            counts["old_rows"] += sum(1 for _ in old[1])
+            old = next(old_groups, None)
+            continue
+        rows = list(new[1])
+        old_last = None
+        counts["rows"] += len(rows)
+        if old is None or new[0] < old[0]:
+            counts["inserted"] += 1
+        else:
+            # En cas de doublons, c'est la dernière occurrence de la clé qui fait foi
+            old_group = deque(old[1])
+            counts["old_rows"] += len(old_group)
+            old_last = old_group[-1]
+            if not same_columns or values(old_last) != rows[-1]:
+                counts["updated"] += 1
+            old = next(old_groups, None)
+        if tracker is not None:
+            change_count = str(tracker.change_count(new[0], old_last, rows[-1]))
+            rows = [row + [change_count] for row in rows]
+        writer.writerows(rows)
+        new = next(new_groups, None)
+    return counts
+
+
+def external_sort_merge(new_path, old_path, id_col, out_path, memory_cap_bytes, tmp_dir, changes_path=None, ts=None, source_file=None):
+    """Build the new master at out_path from the landing file without loading either input in memory.
+
+    The output holds the landing rows ordered by id_col, plus their change_count.
+    Field-level changes against the previous master (old_path may be None) are
+    written to changes_path in change-log format. Returns the change counts.
+    """
+    new_header, new_key, new_runs = sorted_runs(new_path, id_col, memory_cap_bytes, tmp_dir, "new")
+    if old_path is not None:
+        old_header, old_key, old_runs = sorted_runs(old_path, id_col, memory_cap_bytes, tmp_dir, "old")
+    else:
+        old_header, old_key, old_runs = new_header, new_key, []
+    old_values_header = [column for column in old_header if column != changelog.CHANGE_COUNT_COLUMN]
+    changes_path = changes_path or os.path.join(tmp_dir, "changes.csv")
+
+    with open(out_path, "w", newline="") as f, \
+            open(changes_path, "w", newline="") as changes_file, \
+            open_sorted_rows(old_runs, old_key) as old_rows, \
+            open_sorted_rows(new_runs, new_key) as new_rows:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(new_header + [changelog.CHANGE_COUNT_COLUMN])
+        changes_writer = csv.writer(changes_file, lineterminator="\n")
+        changes_writer.writerow(changelog.COLUMNS)
+        tracker = ChangeTracker(old_header, new_header, changes_writer, ts, source_file)
+        counts = merge_sorted(old_rows, new_rows, old_key, new_key, old_values_header == new_header, writer, tracker)
+    counts["columns_changed"] = old_values_header != new_header
+    counts["field_changes"] = tracker.changes
+    return counts
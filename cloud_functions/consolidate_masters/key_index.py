@@ -0,0 +1,224 @@
+# Index de clés et filtre de Bloom publiés à côté de chaque version de master
+"""Point lookups on published masters without downloading them.
+
+A master version is written as row groups that can be read on their own:
+plain CSV lines, or one gzip member per group for compressed masters (the
+object stays a valid gzip file). Two sidecar objects are published next to
+it and referenced from its custom metadata (or from the manifest entry of
+each shard):
+
+- <stem>.index.json.gz: header, byte range of each row group and number of
+  key pages;
+- <stem>.index/<page>.json.gz: row group holding each key, split into pages
+  by hash of the key (MASTER_INDEX_PAGE_KEYS keys per page), so that a lookup
+  only downloads the pages of the keys it asks for;
+- <stem>.bloom: Bloom filter of the keys, so that membership checks for a
+  batch of keys only download a few kilobytes.
+
+Lookups on these sidecars are in master_lookup.py.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+from shared import compression
+
+BLOOM_HEADER = struct.Struct(">QI")
+
+
+def get_row_group_rows():
+    return int(os.getenv("MASTER_INDEX_ROW_GROUP_ROWS", "1000"))
+
+
+def get_page_keys():
+    return int(os.getenv("MASTER_INDEX_PAGE_KEYS", "50000"))
+
+
+def get_bloom_fp_rate():
+    return float(os.getenv("MASTER_BLOOM_FP_RATE", "0.01"))
+
+
+def sidecar_paths(object_path):
+    """Paths of the key index and Bloom filter of a master object."""
+    stem, _ = compression.split_extension(object_path)
+    return f"{stem}.index.json.gz", f"{stem}.bloom"
+
+
+def page_prefix(index_path):
+    """Prefix of the key pages of an index object."""
+    return index_path[:-len(".json.gz")] + "/"
+
+
+def page_path(index_path, page):
+    return f"{page_prefix(index_path)}{page:05d}.json.gz"
+
+
+def page_of(key, num_pages):
+    digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_pages
+
+
+class BloomFilter:
+    def __init__(self, num_bits, num_hashes, bits=None):
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+
+    @classmethod
+    def for_capacity(cls, capacity, fp_rate):
+        capacity = max(1, capacity)
+        num_bits = max(8, int(math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2)))
+        num_hashes = max(1, int(round(num_bits / capacity * math.log(2))))
+        return cls(num_bits, num_hashes)
+
+    def _positions(self, key):
+        # Double hachage : k positions dérivées de deux hachages 64 bits
+        digest = hashlib.blake2b(str(key).encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    def to_bytes(self):
+        return BLOOM_HEADER.pack(self.num_bits, self.num_hashes) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        num_bits, num_hashes = BLOOM_HEADER.unpack_from(data)
+        return cls(num_bits, num_hashes, bytearray(data[BLOOM_HEADER.size:]))
+
+
+def _encode_group(text, object_compression):
+    data = text.encode("utf-8")
+    if object_compression == "gzip":
+        return gzip.compress(data)
+    if object_compression == "none":
+        return data
+    raise ValueError(f"Row-group indexing is not supported for '{object_compression}' objects")
+
+
+def write_indexed(source, id_col, out, object_compression, row_group_rows=None):
+    """Copy CSV text from `source` to the binary stream `out` as row groups, in one pass.
+
+    Returns (index, bloom). A key present several times points to the row
+    group of its last occurrence.
+    """
+    row_group_rows = row_group_rows or get_row_group_rows()
+    reader = csv.reader(source)
+    header = next(reader, [])
+    key_col = header.index(id_col)
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\n")
+    row_groups = []
+    keys = {}
+    offset = 0
+
+    def flush(group_rows):
+        nonlocal offset
+        text.seek(0)
+        text.truncate()
+        writer.writerows(group_rows)
+        payload = _encode_group(text.getvalue(), object_compression)
+        out.write(payload)
+        offset += len(payload)
+        return [offset - len(payload), len(payload)]
+
+    # L'en-tête forme son propre groupe pour que chaque groupe se lise seul
+    flush([header])
+    rows = 0
+    group_rows = []
+    for record in reader:
+        keys[record[key_col]] = len(row_groups)
+        group_rows.append(record)
+        if len(group_rows) == row_group_rows:
+            row_groups.append(flush(group_rows))
+            rows += len(group_rows)
+            group_rows = []
+    if group_rows:
+        row_groups.append(flush(group_rows))
+        rows += len(group_rows)
+
+    bloom = BloomFilter.for_capacity(len(keys), get_bloom_fp_rate())
+    for key in keys:
+        bloom.add(key)
+    index = {
+        "id_col": id_col,
+        "compression": object_compression,
+        "header": header,
+        "rows": rows,
+        "row_groups": row_groups,
+        "keys": keys,
+    }
+    return index, bloom
+
+
+def _upload_json(bucket, path, value):
+    bucket.blob(path).upload_from_string(gzip.compress(json.dumps(value).encode("utf-8")), "application/gzip")
+
+
+def _download_json(bucket, path):
+    return json.loads(gzip.decompress(bucket.blob(path).download_as_bytes()))
+
+
+def upload_sidecars(bucket, object_path, index, bloom, page_keys=None):
+    """Upload the index pages, index and Bloom filter of a master object; returns the metadata pointing to them."""
+    index_path, bloom_path = sidecar_paths(object_path)
+    keys = index["keys"]
+    num_pages = max(1, math.ceil(len(keys) / (page_keys or get_page_keys())))
+    pages = [{} for _ in range(num_pages)]
+    for key, group in keys.items():
+        pages[page_of(key, num_pages)][key] = group
+    # Pages écrites avant l'index qui les annonce
+    for page, entries in enumerate(pages):
+        _upload_json(bucket, page_path(index_path, page), entries)
+    directory = {name: value for name, value in index.items() if name != "keys"}
+    directory["num_pages"] = num_pages
+    _upload_json(bucket, index_path, directory)
+    bucket.blob(bloom_path).upload_from_string(bloom.to_bytes(), "application/octet-stream")
+    return {"key_index": index_path, "bloom_filter": bloom_path}
+
+
+def load_bloom(bucket, path):
+    return BloomFilter.from_bytes(bucket.blob(path).download_as_bytes())
+
+
+def load_index(bucket, path):
+    """Index of a master object, without its key pages."""
+    return _download_json(bucket, path)
+
+
+def _load_pages(bucket, path, pages):
+    with ThreadPoolExecutor(max_workers=min(8, len(pages) or 1)) as executor:
+        return list(executor.map(lambda page: _download_json(bucket, page_path(path, page)), pages))
+
+
+def load_key_groups(bucket, path, index, keys):
+    """{key: row group} for those of `keys` present in the object; only their pages are downloaded."""
+    if "keys" in index:
+        # Index d'une version publiée avant le découpage en pages
+        return {key: index["keys"][key] for key in keys if key in index["keys"]}
+    wanted = {}
+    for key in keys:
+        wanted.setdefault(page_of(key, index["num_pages"]), []).append(key)
+    groups = {}
+    for page_keys, entries in zip(wanted.values(), _load_pages(bucket, path, list(wanted))):
+        groups.update({key: entries[key] for key in page_keys if key in entries})
+    return groups
+
+
+def load_all_keys(bucket, path, index):
+    """Every key of the object, from all its pages."""
+    if "keys" in index:
+        return list(index["keys"])
+    return [key for entries in _load_pages(bucket, path, list(range(index["num_pages"]))) for key in entries]
@@ -1,6 +1,7 @@
 #ceci est un commentaire 
+import numpy as np
 import pandas as pd
-from google.cloud import storage, bigquery
+from google.cloud import bigquery
 from datetime import datetime
 import io
 import logging
@@ -9,8 +10,20 @@ import hashlib
 import os
 import time
 from io import StringIO
+from concurrent.futures import ProcessPoolExecutor
+import tempfile
 import sys
 
+import event_ledger
+import external_merge
+import key_index
+import master_cache
+import master_lookup
+import referential_integrity
+import sharding
+from shared import changelog, compression, memory_profile, transfer
+from shared import storage_backend as storage
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s %(levelname)s %(message)s',
@@ -24,6 +37,39 @@ if not BUCKET:
     logger.error("Environment variable RETAIL_DATA_LANDING_ZONE_BUCKET is not set.")
     raise EnvironmentError("RETAIL_DATA_LANDING_ZONE_BUCKET environment variable is required.")
 
+# Mémoire minimale laissée au tri externe quand le budget mémoire est presque épuisé
+MIN_SORT_MEMORY_BYTES = 16 * 1024 * 1024
+
+# Métadonnées personnalisées portant l'empreinte du contenu et la génération pour laquelle elle a été calculée
+FINGERPRINT_KEY = "content_fingerprint"
+FINGERPRINT_GENERATION_KEY = "fingerprint_generation"
+# Deux hachages de ligne indépendants (clés de 16 caractères) sommés sur tout le fichier
+FINGERPRINT_HASH_KEYS = ("fingerprint-key1", "fingerprint-key2")
+FINGERPRINT_CHUNK_ROWS = 100_000
+
+def get_entity_setting(entity, name, default):
+    # Une variable suffixée par l'entité (ex. MASTER_NUM_SHARDS_CUSTOMERS) surcharge la valeur globale
+    return os.getenv(f"{name}_{entity.upper()}", os.getenv(name, default))
+
+def get_master_compression(entity):
+    # BigQuery ne charge que du CSV non compressé ou gzip : un master configuré en zstd est publié en gzip
+    master_compression = compression.get_compression(entity)
+    return "gzip" if master_compression == "zstd" else master_compression
+
+def master_path_for(entity):
+    return compression.csv_path(f"master/{entity}/{entity}_master", get_master_compression(entity))
+
+def find_master_path(bucket, entity):
+    # Master courant, quelle que soit la compression avec laquelle il a été publié
+    configured = master_path_for(entity)
+    candidates = [configured] + [
+        compression.csv_path(f"master/{entity}/{entity}_master", c) for c in compression.EXTENSIONS
+    ]
+    for path in dict.fromkeys(candidates):
+        if bucket.blob(path).exists():
+            return path
+    return configured
+
 # Buffer en mémoire pour stocker les logs d'étapes
 step_logs_buffer = []
 
@@ -39,6 +85,7 @@ def append_step_log_buffer(entity, source_file, step, status, message="", rows=N
         "duration_sec": duration_sec if duration_sec is not None else ""
     }
     step_logs_buffer.append(log_entry)
+    memory_profile.current().checkpoint(step)
 
 def flush_step_logs(bucket, entity):
     audit_path = f"master/{entity}/audit/step_log.csv"
@@ -55,22 +102,81 @@ def flush_step_logs(bucket, entity):
     logger.info(f"Flushed {len(step_logs_buffer)} step logs to {audit_path}")
     step_logs_buffer.clear()
 
-def get_file_hash(bucket_name, file_path):
+def download_text(blob):
+    data = transfer.download_as_bytes(blob)
+    raw = compression.decompress_bytes(data, compression.compression_from_path(blob.name))
+    return raw.decode("utf-8"), len(data), len(raw)
+
+def download_to_local(bucket, path, local_path, blob=None):
+    # Télécharge l'objet tel quel puis le décompresse sur disque (blob : génération déjà lue à télécharger)
+    blob = blob or bucket.blob(path)
+    object_compression = compression.compression_from_path(path)
+    if object_compression == "none":
+        transfer.download_to_filename(blob, local_path)
+        size = os.path.getsize(local_path)
+        return size, size
+    compressed_path = local_path + compression.EXTENSIONS[object_compression]
+    transfer.download_to_filename(blob, compressed_path)
+    transferred = os.path.getsize(compressed_path)
+    raw = compression.decompress_file(compressed_path, local_path, object_compression)
+    os.remove(compressed_path)
+    return transferred, raw
+
+def transfer_message(action, transferred, raw):
+    return f"{action} - {transferred} bytes transferred ({raw} bytes uncompressed)"
+
+def read_fingerprint(blob):
+    # Empreinte valide seulement si elle a été calculée pour la génération courante de l'objet
+    metadata = blob.metadata or {}
+    if metadata.get(FINGERPRINT_KEY) and metadata.get(FINGERPRINT_GENERATION_KEY) == str(blob.generation):
+        return metadata[FINGERPRINT_KEY]
+    return None
+
+def record_fingerprint(blob, file_hash):
+    # Écriture conditionnelle : un objet réécrit entre-temps ne reçoit pas l'empreinte de l'ancien contenu
+    try:
+        blob.metadata = {**(blob.metadata or {}), FINGERPRINT_KEY: file_hash, FINGERPRINT_GENERATION_KEY: str(blob.generation)}
+        blob.patch(if_generation_match=blob.generation)
+    except Exception as e:
+        logger.warning(f"Could not store fingerprint on {blob.name}: {str(e)}")
+
+def csv_fingerprint(path):
+    # Empreinte indépendante de l'ordre des lignes, calculée par morceaux sans charger le fichier :
+    # sommes modulo 2**64 des hachages de chaque ligne, avec l'en-tête et le nombre de lignes.
+    # Le compteur de changements du master n'y entre pas : elle reste comparable au fichier d'arrivée
+    header = [column for column in pd.read_csv(path, dtype=str, nrows=0).columns if column != changelog.CHANGE_COUNT_COLUMN]
+    rows = 0
+    totals = np.zeros(len(FINGERPRINT_HASH_KEYS), dtype=np.uint64)
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, usecols=header, chunksize=FINGERPRINT_CHUNK_ROWS):
+        chunk = chunk[header]
+        rows += len(chunk)
+        totals += np.array([pd.util.hash_pandas_object(chunk, index=False, hash_key=key).to_numpy().sum() for key in FINGERPRINT_HASH_KEYS], dtype=np.uint64)
+    return hashlib.md5(json.dumps([header, rows, [int(total) for total in totals]]).encode()).hexdigest()
+
+def get_file_hash(bucket_name, file_path, blob=None, local_path=None):
+    # blob et local_path : objet déjà lu et sa copie locale décompressée, pour ne pas le télécharger une seconde fois
     client = storage.Client()
     start = time.time()
     try:
-        blob = client.bucket(bucket_name).blob(file_path)
-        if not blob.exists():
+        blob = blob or client.bucket(bucket_name).get_blob(file_path)
+        if blob is None:
             logger.warning(f"File not found for hashing: gs://{bucket_name}/{file_path}")
             append_step_log_buffer("", file_path, "hash_calculation", "warning", "File not found for hashing")
             return None
-        data = blob.download_as_text()
-        df = pd.read_csv(io.StringIO(data))
-        df_sorted = df.sort_values(by=list(df.columns))
-        file_hash = hashlib.md5(df_sorted.to_csv(index=False).encode()).hexdigest()
+        file_hash = read_fingerprint(blob)
+        if file_hash is not None:
+            append_step_log_buffer("", file_path, "hash_calculation", "success", f"Hash read from metadata: {file_hash}", duration_sec=time.time() - start)
+            return file_hash
+        transferred = raw = 0
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if local_path is None:
+                local_path = os.path.join(tmp_dir, "object.csv")
+                transferred, raw = download_to_local(client.bucket(bucket_name), file_path, local_path, blob)
+            file_hash = csv_fingerprint(local_path)
+        record_fingerprint(blob, file_hash)
         duration = time.time() - start
         logger.info(f"Calculated hash for gs://{bucket_name}/{file_path}: {file_hash}")
-        append_step_log_buffer("", file_path, "hash_calculation", "success", f"Hash calculated: {file_hash}", duration_sec=duration)
+        append_step_log_buffer("", file_path, "hash_calculation", "success", transfer_message(f"Hash calculated: {file_hash}", transferred, raw), duration_sec=duration)
         return file_hash
     except Exception as e:
         duration = time.time() - start
@@ -78,27 +184,69 @@ def get_file_hash(bucket_name, file_path):
         append_step_log_buffer("", file_path, "hash_calculation", "failure", str(e), duration_sec=duration)
         return None
 
-def upload_csv(df, bucket, path):
+def upload_csv(df, bucket, path, id_col=None):
+    if id_col is not None:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            local_path = os.path.join(tmp_dir, "master.csv")
+            df.to_csv(local_path, index=False)
+            return upload_file(local_path, bucket, path, id_col)
+    start = time.time()
+    try:
+        object_compression = compression.compression_from_path(path)
+        data = df.to_csv(index=False).encode("utf-8")
+        payload = compression.compress_bytes(data, object_compression)
+        transfer.upload_from_string(bucket, path, payload, compression.CONTENT_TYPES[object_compression])
+        duration = time.time() - start
+        logger.info(f"File uploaded: gs://{BUCKET}/{path}")
+        append_step_log_buffer("", path, "upload_csv", "success", transfer_message("Uploaded file", len(payload), len(data)), duration_sec=duration)
+    except Exception as e:
+        duration = time.time() - start
+        logger.error(f"Error uploading file to gs://{BUCKET}/{path}: {str(e)}")
+        append_step_log_buffer("", path, "upload_csv", "failure", str(e), duration_sec=duration)
+        raise
+
+def upload_file(local_path, bucket, path, id_col=None):
+    # Avec id_col, le master est écrit par groupes de lignes et publié avec son index de clés et son filtre de Bloom
     start = time.time()
     try:
-        blob = bucket.blob(path)
-        blob.upload_from_string(df.to_csv(index=False), 'text/csv')
+        object_compression = compression.compression_from_path(path)
+        raw = os.path.getsize(local_path)
+        upload_path = local_path
+        if id_col is not None:
+            upload_path = local_path + ".indexed"
+            with open(local_path, newline="") as source, open(upload_path, "wb") as out:
+                index, bloom = key_index.write_indexed(source, id_col, out, object_compression)
+        elif object_compression != "none":
+            upload_path = local_path + compression.EXTENSIONS[object_compression]
+            compression.compress_file(local_path, upload_path, object_compression)
+        transfer.upload_from_filename(bucket, path, upload_path, compression.CONTENT_TYPES[object_compression])
+        if id_col is not None:
+            blob = bucket.blob(path)
+            blob.metadata = key_index.upload_sidecars(bucket, path, index, bloom)
+            blob.patch()
         duration = time.time() - start
         logger.info(f"File uploaded: gs://{BUCKET}/{path}")
-        append_step_log_buffer("", path, "upload_csv", "success", f"Uploaded file", duration_sec=duration)
+        append_step_log_buffer("", path, "upload_csv", "success", transfer_message("Uploaded file", os.path.getsize(upload_path), raw), duration_sec=duration)
     except Exception as e:
         duration = time.time() - start
         logger.error(f"Error uploading file to gs://{BUCKET}/{path}: {str(e)}")
         append_step_log_buffer("", path, "upload_csv", "failure", str(e), duration_sec=duration)
         raise
 
+def get_blob_size(bucket, path):
+    # Taille estimée une fois décompressé
+    blob = bucket.get_blob(path)
+    if blob is None:
+        return 0
+    return blob.size * compression.SIZE_FACTORS[compression.compression_from_path(path)]
+
 def move_to_history(bucket, current_path, entity):
     start = time.time()
     try:
         timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
         filename = os.path.basename(current_path)
-        filename_without_ext = os.path.splitext(filename)[0]
-        history_filename = f"{filename_without_ext}_{timestamp}.csv"
+        filename_without_ext, ext = compression.split_extension(filename)
+        history_filename = f"{filename_without_ext}_{timestamp}{ext}"
         history_path = f"master/{entity}/history/{history_filename}"
 
         source_blob = bucket.blob(current_path)
@@ -154,7 +302,13 @@ def log_audit(bucket, entity, event_data):
     except Exception as e:
         logger.error(f"Error updating audit log {audit_path}: {str(e)}")
 
-def load_csv_to_bigquery(dataset_id, table_id, gcs_uri, write_disposition="WRITE_TRUNCATE"):
+def load_csv_to_bigquery(dataset_id, table_id, gcs_uri, write_disposition="WRITE_TRUNCATE", partition_field=None, schema=None):
+    # Exécutions locales (backfill) : pas d'entrepôt à alimenter
+    if os.getenv("BIGQUERY_LOAD", "true").lower() == "false":
+        logger.info(f"BigQuery load disabled, skipping {dataset_id}.{table_id}")
+        append_step_log_buffer("", gcs_uri, "bigquery_load", "info", "BigQuery load disabled (BIGQUERY_LOAD=false)")
+        return True
+
     client = bigquery.Client()
     table_ref = client.dataset(dataset_id).table(table_id)
     start_time = time.time()
@@ -164,9 +318,13 @@ def load_csv_to_bigquery(dataset_id, table_id, gcs_uri, write_disposition="WRITE
     job_config = bigquery.LoadJobConfig(
         source_format=bigquery.SourceFormat.CSV,
         skip_leading_rows=1,
-        autodetect=True,
+        autodetect=schema is None,
         write_disposition=write_disposition,
     )
+    if schema is not None:
+        job_config.schema = [bigquery.SchemaField(name, field_type) for name, field_type in schema]
+    if partition_field:
+        job_config.time_partitioning = bigquery.TimePartitioning(type_=bigquery.TimePartitioningType.DAY, field=partition_field)
 
     try:
         load_job = client.load_table_from_uri(
@@ -203,43 +361,165 @@ def load_csv_to_bigquery(dataset_id, table_id, gcs_uri, write_disposition="WRITE
         )
         return False
 
+# Schéma explicite du journal : l'autodétection peut typer old/new en nombres et ts doit rester un horodatage
+CHANGES_SCHEMA = [
+    ("key", "STRING"), ("field", "STRING"), ("old", "STRING"), ("new", "STRING"),
+    ("ts", "TIMESTAMP"), ("source_file", "STRING"),
+]
+
+def write_changes(bucket, entity, new_file, write):
+    # Journal des changements champ par champ, ajouté à la table {entity}_changes partitionnée par jour
+    start = time.time()
+    try:
+        paths = [path for path in write() if path]
+    except Exception as e:
+        append_step_log_buffer(entity, new_file, "write_changes", "failure", str(e), duration_sec=time.time() - start)
+        return [], "failed"
+    if not paths:
+        append_step_log_buffer(entity, new_file, "write_changes", "success", "No field-level changes", duration_sec=time.time() - start)
+        return [], "not_executed"
+    append_step_log_buffer(entity, new_file, "write_changes", "success", f"Wrote {len(paths)} change-log object(s)", duration_sec=time.time() - start)
+    bq_success = load_csv_to_bigquery("retail", f"{entity}_changes", [f"gs://{BUCKET}/{path}" for path in paths], "WRITE_APPEND", partition_field="ts", schema=CHANGES_SCHEMA)
+    return paths, "success" if bq_success else "partial_failure"
+
+def read_master(bucket, entity, master_path):
+    # Lecture des seules métadonnées : la génération courante valide l'entrée du cache avant usage
+    cache = master_cache.current()
+    blob = bucket.get_blob(master_path)
+    if blob is None:
+        # Master supprimé depuis la recherche de son chemin : traité comme absent
+        append_step_log_buffer(entity, master_path, "master_cache", "warning", "Master no longer exists")
+        return None, 0, 0
+    df = cache.get(entity, master_path, blob.generation)
+    if df is not None:
+        append_step_log_buffer(entity, master_path, "master_cache", "success", f"Hit for generation {blob.generation} - {cache.stats()}", rows=len(df))
+        return df, 0, 0
+    data, transferred, raw = download_text(blob)
+    df = pd.read_csv(io.StringIO(data), dtype=str, keep_default_na=False)
+    append_step_log_buffer(entity, master_path, "master_cache", "success", f"Miss for generation {blob.generation} - {cache.stats()}", rows=len(df))
+    return df, transferred, raw
+
+def cache_master(bucket, entity, df):
+    # Le master publié reste en mémoire pour le prochain événement traité par cette instance
+    cache = master_cache.current()
+    blob = bucket.get_blob(master_path_for(entity))
+    if blob is not None and cache.put(entity, blob.name, blob.generation, df, memory_profile.current().remaining_bytes()):
+        append_step_log_buffer(entity, blob.name, "master_cache", "success", f"Cached generation {blob.generation} - {cache.stats()}", rows=len(df))
+
 def process_mastering(entity, new_file, id_col):
     client = storage.Client()
     bucket = client.bucket(BUCKET)
 
-    master_dir = f"master/{entity}"
-    master_path = f"{master_dir}/{entity}_master.csv"
-
-    logger.info(f"Starting mastering process for entity '{entity}' with new file: {new_file}")
-    append_step_log_buffer(entity, new_file, "start_mastering", "success", "Starting mastering process")
+    num_shards = int(get_entity_setting(entity, "MASTER_NUM_SHARDS", "1"))
+    if num_shards == 1:
+        # Découpage désactivé : le dernier master découpé redevient un fichier unique avant toute comparaison
+        manifest_path = f"master/{entity}/{entity}_master_manifest.json"
+        manifest = read_manifest(bucket, manifest_path)
+        if manifest is not None and not merge_shards_to_master(bucket, entity, id_col, manifest_path, manifest):
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "unshard_failed"}
+    master_path = find_master_path(bucket, entity)
 
     start = time.time()
-    new_hash = get_file_hash(BUCKET, new_file)
-    if new_hash is None:
-        append_step_log_buffer(entity, new_file, "hash_calculation", "failure", "Failed to calculate hash")
+    landing_blob = bucket.get_blob(new_file)
+    if landing_blob is None:
+        append_step_log_buffer(entity, new_file, "download_file", "failure", f"gs://{BUCKET}/{new_file} not found")
         flush_step_logs(bucket, entity)
-        return {"action": "error", "reason": "new_file_hash_failed"}
-
-    current_hash = get_file_hash(BUCKET, master_path)
+        return {"action": "error", "reason": "download_or_read_failed"}
 
-    if new_hash == current_hash:
-        append_step_log_buffer(entity, new_file, "compare_hash", "success", "No changes detected")
+    # Comparaison des empreintes avant tout choix de chemin : un fichier identique au master n'est jamais fusionné
+    if num_shards > 1:
+        # Master découpé : empreinte portée par le manifest, valable pour le même découpage seulement
+        manifest = read_manifest(bucket, f"master/{entity}/{entity}_master_manifest.json")
+        same_layout = manifest is not None and manifest["num_shards"] == num_shards and manifest["id_col"] == id_col
+        current_hash = manifest.get("fingerprint") if same_layout else None
+    else:
+        current_hash = get_file_hash(BUCKET, master_path)
+    # Fichier redélivré (même génération) : son empreinte est déjà sur l'objet, aucun téléchargement
+    if current_hash is not None and read_fingerprint(landing_blob) == current_hash:
+        append_step_log_buffer(entity, new_file, "compare_hash", "success", "No changes detected (stored fingerprint)")
         flush_step_logs(bucket, entity)
         return {"action": "unchanged", "reason": "identical_content"}
 
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Fichier d'arrivée téléchargé une seule fois : il sert à l'empreinte puis à la fusion, quel que soit le mode
+        landing_local = os.path.join(tmp_dir, "landing.csv")
+        try:
+            transferred, raw = download_to_local(bucket, new_file, landing_local, landing_blob)
+            append_step_log_buffer(entity, new_file, "download_file", "success", transfer_message("Downloaded landing file to local disk", transferred, raw), duration_sec=time.time() - start)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "download_file", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "download_or_read_failed"}
+
+        new_hash = get_file_hash(BUCKET, new_file, landing_blob, landing_local)
+        if new_hash is None:
+            append_step_log_buffer(entity, new_file, "hash_calculation", "failure", "Failed to calculate hash")
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "new_file_hash_failed"}
+        if new_hash == current_hash:
+            append_step_log_buffer(entity, new_file, "compare_hash", "success", "No changes detected")
+            flush_step_logs(bucket, entity)
+            return {"action": "unchanged", "reason": "identical_content"}
+
+        if num_shards > 1:
+            return process_mastering_sharded(entity, new_file, id_col, num_shards, landing_local, new_hash)
+
+        # Au-delà du plafond mémoire, ou si le budget mémoire ne permet pas de tout charger, on bascule sur le tri externe
+        memory_cap_bytes = int(float(get_entity_setting(entity, "MASTER_MEMORY_CAP_MB", "128")) * 1024 * 1024)
+        input_bytes = get_blob_size(bucket, new_file) + get_blob_size(bucket, master_path)
+        projected_bytes = input_bytes * memory_profile.IN_MEMORY_CSV_FACTOR
+        profile = memory_profile.current()
+        # Le cache des masters occupe une partie du RSS mesuré : il cède sa place avant la décision
+        remaining = profile.remaining_bytes()
+        if remaining is not None and remaining < projected_bytes:
+            cache = master_cache.current()
+            freed = cache.evict(projected_bytes - remaining, keep=entity)
+            if freed:
+                append_step_log_buffer(entity, new_file, "master_cache", "success", f"Evicted {freed} bytes for the memory budget - {cache.stats()}")
+        if input_bytes > memory_cap_bytes or not profile.fits("process_mastering", projected_bytes):
+            remaining = profile.remaining_bytes()
+            if remaining is not None:
+                memory_cap_bytes = max(MIN_SORT_MEMORY_BYTES, min(memory_cap_bytes, remaining))
+            return process_mastering_out_of_core(entity, new_file, id_col, memory_cap_bytes, landing_local, new_hash)
+
+        return process_mastering_in_memory(entity, new_file, id_col, landing_local, new_hash, current_hash is not None)
+
+def process_mastering_in_memory(entity, new_file, id_col, landing_local, new_hash, has_master):
+    client = storage.Client()
+    bucket = client.bucket(BUCKET)
+
+    master_path = find_master_path(bucket, entity)
+
+    logger.info(f"Starting mastering process for entity '{entity}' with new file: {new_file}")
+    append_step_log_buffer(entity, new_file, "start_mastering", "success", "Starting mastering process")
+
+    start = time.time()
     try:
-        data = bucket.blob(new_file).download_as_text()
-        new_df = pd.read_csv(io.StringIO(data))
-        append_step_log_buffer(entity, new_file, "download_file", "success", rows=len(new_df))
+        # Lecture en chaînes : les valeurs sont réécrites telles quelles et comparées champ par champ
+        new_df = pd.read_csv(landing_local, dtype=str, keep_default_na=False)
+        old_df = None
+        transferred = raw = 0
+        if has_master:
+            old_df, transferred, raw = read_master(bucket, entity, master_path)
+            has_master = old_df is not None
+        append_step_log_buffer(entity, new_file, "read_files", "success", transfer_message("Read landing and master files", transferred, raw), rows=len(new_df))
     except Exception as e:
         append_step_log_buffer(entity, new_file, "download_file", "failure", str(e))
         flush_step_logs(bucket, entity)
         return {"action": "error", "reason": "download_or_read_failed"}
 
-    if current_hash is None:
+    ts = datetime.utcnow().isoformat()
+    changes = changelog.diff_frames(old_df, new_df, id_col, ts, new_file) if old_df is not None else pd.DataFrame(columns=changelog.COLUMNS)
+    new_df = changelog.with_change_counts(new_df, old_df, id_col, changes)
+    del old_df
+
+    if not has_master:
         append_step_log_buffer(entity, new_file, "create_master", "success", "No existing master found, creating new master")
         try:
-            upload_csv(new_df, bucket, master_path)
+            upload_csv(new_df, bucket, master_path_for(entity), id_col)
+            record_fingerprint(bucket.get_blob(master_path_for(entity)), new_hash)
+            cache_master(bucket, entity, new_df)
             flush_step_logs(bucket, entity)
             return {"action": "created", "rows": len(new_df)}
         except Exception as e:
@@ -247,24 +527,42 @@ def process_mastering(entity, new_file, id_col):
             flush_step_logs(bucket, entity)
             return {"action": "error", "reason": "upload_failed"}
 
-    history_path = move_to_history(bucket, master_path, entity)
+    result = publish_master_version(bucket, entity, new_file, lambda path: upload_csv(new_df, bucket, path, id_col), len(new_df), start, fingerprint=new_hash)
+    if result["action"] == "mastered":
+        result["changelog"], result["changelog_bigquery_status"] = write_changes(
+            bucket, entity, new_file, lambda: [changelog.write_changes(bucket, entity, changes, changelog.partition_day(new_file, ts), changelog.changes_name(new_file, result["version"]))])
+        result["field_changes"] = len(changes)
+        cache_master(bucket, entity, new_df)
+        flush_step_logs(bucket, entity)
+    return result
+
+def publish_master_version(bucket, entity, new_file, upload, rows, start, fingerprint=None):
+    master_dir = f"master/{entity}"
+    current_master_path = find_master_path(bucket, entity)
+    master_path = master_path_for(entity)
+
+    history_path = move_to_history(bucket, current_master_path, entity)
     if history_path is None:
-        append_step_log_buffer(entity, master_path, "move_to_history", "warning", "History archiving failed or skipped")
+        append_step_log_buffer(entity, current_master_path, "move_to_history", "warning", "History archiving failed or skipped")
 
     clean_history(bucket, entity, max_versions=5)
 
     timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    new_master_path = f"{master_dir}/{entity}_master_{timestamp}.csv"
+    _, ext = compression.split_extension(master_path)
+    new_master_path = f"{master_dir}/{entity}_master_{timestamp}{ext}"
 
     try:
-        upload_csv(new_df, bucket, new_master_path)
+        upload(new_master_path)
     except Exception as e:
         append_step_log_buffer(entity, new_master_path, "upload_timestamped_master", "failure", str(e))
         flush_step_logs(bucket, entity)
         return {"action": "error", "reason": "upload_failed"}
 
     try:
-        bucket.copy_blob(bucket.blob(new_master_path), bucket, master_path)
+        master_blob = bucket.copy_blob(bucket.blob(new_master_path), bucket, master_path)
+        # Le master courant porte l'empreinte de son contenu : le prochain événement n'a pas à le re-hacher
+        if fingerprint is not None:
+            record_fingerprint(master_blob, fingerprint)
         append_step_log_buffer(entity, master_path, "update_master", "success", "Updated main master file")
     except Exception as e:
         append_step_log_buffer(entity, master_path, "update_master", "failure", str(e))
@@ -302,23 +600,380 @@ def process_mastering(entity, new_file, id_col):
 
     return {
         "action": "mastered",
-        "rows": len(new_df),
+        "rows": rows,
         "current_master": master_path,
         "timestamped_version": new_master_path,
+        "version": timestamp,
         "history": history_path,
         "bigquery_status": bq_status
     }
 
+def process_mastering_out_of_core(entity, new_file, id_col, memory_cap_bytes, landing_local, new_hash):
+    client = storage.Client()
+    bucket = client.bucket(BUCKET)
+
+    master_path = find_master_path(bucket, entity)
+
+    logger.info(f"Starting out-of-core mastering for entity '{entity}' with new file: {new_file}")
+    append_step_log_buffer(entity, new_file, "start_mastering", "success", f"Starting out-of-core mastering process (memory cap {memory_cap_bytes // (1024 * 1024)} MB)")
+    start = time.time()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            master_local = None
+            if bucket.blob(master_path).exists():
+                master_local = os.path.join(tmp_dir, "current_master.csv")
+                transferred, raw = download_to_local(bucket, master_path, master_local)
+                append_step_log_buffer(entity, master_path, "download_file", "success", transfer_message("Downloaded master file to local disk", transferred, raw), duration_sec=time.time() - start)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "download_file", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "download_or_read_failed"}
+
+        merge_start = time.time()
+        out_path = os.path.join(tmp_dir, "new_master.csv")
+        changes_path = os.path.join(tmp_dir, "changes.csv")
+        ts = datetime.utcnow().isoformat()
+        try:
+            counts = external_merge.external_sort_merge(landing_local, master_local, id_col, out_path, memory_cap_bytes, tmp_dir, changes_path, ts, new_file)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "external_sort_merge", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "sort_merge_failed"}
+        changes = {key: counts[key] for key in ("inserted", "updated", "deleted")}
+        append_step_log_buffer(entity, new_file, "external_sort_merge", "success", json.dumps(changes), rows=counts["rows"], duration_sec=time.time() - merge_start)
+
+        if master_local is not None and not counts["columns_changed"] and counts["rows"] == counts["old_rows"] and not any(changes.values()):
+            append_step_log_buffer(entity, new_file, "compare_hash", "success", "No changes detected")
+            flush_step_logs(bucket, entity)
+            return {"action": "unchanged", "reason": "identical_content"}
+
+        if master_local is None:
+            append_step_log_buffer(entity, new_file, "create_master", "success", "No existing master found, creating new master")
+            try:
+                upload_file(out_path, bucket, master_path_for(entity), id_col)
+                record_fingerprint(bucket.get_blob(master_path_for(entity)), new_hash)
+                flush_step_logs(bucket, entity)
+                return {"action": "created", "rows": counts["rows"], "changes": changes}
+            except Exception as e:
+                append_step_log_buffer(entity, new_file, "upload_master", "failure", str(e))
+                flush_step_logs(bucket, entity)
+                return {"action": "error", "reason": "upload_failed"}
+
+        result = publish_master_version(bucket, entity, new_file, lambda path: upload_file(out_path, bucket, path, id_col), counts["rows"], start, fingerprint=new_hash)
+        if result["action"] == "mastered":
+            result["changelog"], result["changelog_bigquery_status"] = write_changes(
+                bucket, entity, new_file, lambda: [changelog.upload_changes_file(bucket, entity, changes_path, changelog.partition_day(new_file, ts), changelog.changes_name(new_file, result["version"]))])
+            result["field_changes"] = counts["field_changes"]
+            flush_step_logs(bucket, entity)
+
+    if result["action"] == "mastered":
+        result["changes"] = changes
+    return result
+
+def read_manifest(bucket, manifest_path):
+    blob = bucket.blob(manifest_path)
+    if not blob.exists():
+        return None
+    return json.loads(blob.download_as_text())
+
+def merge_shards_to_master(bucket, entity, id_col, manifest_path, manifest):
+    # Les shards du manifest sont réunis en un master unique, publié avec son index de clés et son empreinte,
+    # puis le manifest part dans l'historique pour que les lectures ne le préfèrent plus au fichier unique
+    master_path = master_path_for(entity)
+    start = time.time()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_files = []
+            for n, shard in enumerate(manifest["shards"]):
+                shard_files.append(os.path.join(tmp_dir, f"shard-{n:05d}.csv"))
+                download_to_local(bucket, shard["path"], shard_files[-1])
+            merged = os.path.join(tmp_dir, "master.csv")
+            columns = list(pd.read_csv(shard_files[0], dtype=str, nrows=0).columns)
+            pd.DataFrame(columns=columns).to_csv(merged, index=False)
+            rows = 0
+            for chunk in sharding.iter_csv_chunks(shard_files):
+                chunk.reindex(columns=columns, fill_value="").to_csv(merged, mode="a", header=False, index=False)
+                rows += len(chunk)
+            upload_file(merged, bucket, master_path, id_col)
+        if manifest.get("fingerprint"):
+            record_fingerprint(bucket.get_blob(master_path), manifest["fingerprint"])
+        append_step_log_buffer(entity, master_path, "merge_shards", "success", f"Merged {len(manifest['shards'])} shards of version {manifest['version']} into a single master", rows=rows, duration_sec=time.time() - start)
+    except Exception as e:
+        logger.error(f"Error merging shards of {manifest_path}: {str(e)}")
+        append_step_log_buffer(entity, master_path, "merge_shards", "failure", str(e), duration_sec=time.time() - start)
+        return False
+    if move_to_history(bucket, manifest_path, entity) is None:
+        return False
+    clean_history(bucket, entity, max_versions=5)
+    clean_shard_versions(bucket, entity, {"shards": []})
+    return True
+
+def clean_shard_versions(bucket, entity, manifest):
+    # Supprime les shards (et leurs index) qui ne sont plus référencés par le manifest courant ni par l'historique
+    def shard_objects(shards):
+        return {shard.get(key) for shard in shards for key in ("path", "key_index", "bloom_filter")} - {None}
+
+    referenced = shard_objects(manifest["shards"])
+    for blob in bucket.list_blobs(prefix=f"master/{entity}/history/"):
+        if blob.name.endswith(".json"):
+            try:
+                referenced.update(shard_objects(json.loads(blob.download_as_text())["shards"]))
+            except Exception as e:
+                logger.warning(f"Unreadable history manifest {blob.name}, keeping all shards: {str(e)}")
+                return
+    # Les pages d'un index référencé le sont aussi
+    page_prefixes = tuple(key_index.page_prefix(path) for path in referenced if path.endswith(".index.json.gz"))
+    deleted = 0
+    for blob in bucket.list_blobs(prefix=f"master/{entity}/shards/"):
+        if blob.name not in referenced and not blob.name.startswith(page_prefixes):
+            bucket.delete_blob(blob.name)
+            deleted += 1
+    logger.info(f"Deleted {deleted} unreferenced shard objects for entity '{entity}'.")
+
+def run_shard_merges(tasks):
+    workers = min(int(os.getenv("MASTER_SHARD_WORKERS", os.cpu_count() or 1)), len(tasks))
+    # Moins de fusions en parallèle si le budget mémoire ne permet pas de charger autant de shards à la fois
+    # (ancienne version d'un shard estimée à la taille de la nouvelle)
+    profile = memory_profile.current()
+    per_shard = 2 * max(os.path.getsize(task["landing_path"]) for task in tasks) * memory_profile.IN_MEMORY_CSV_FACTOR
+    if workers > 1 and per_shard and not profile.fits("merge_shards", workers * per_shard):
+        workers = max(1, min(workers, profile.remaining_bytes() // per_shard))
+    if workers <= 1:
+        return [sharding.merge_shard(task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(sharding.merge_shard, tasks))
+
+def process_mastering_sharded(entity, new_file, id_col, num_shards, landing_local, new_hash):
+    client = storage.Client()
+    bucket = client.bucket(BUCKET)
+
+    master_dir = f"master/{entity}"
+    master_path = find_master_path(bucket, entity)
+    manifest_path = f"{master_dir}/{entity}_master_manifest.json"
+
+    logger.info(f"Starting sharded mastering for entity '{entity}' ({num_shards} shards) with new file: {new_file}")
+    append_step_log_buffer(entity, new_file, "start_mastering", "success", f"Starting sharded mastering process ({num_shards} shards)")
+    start = time.time()
+
+    manifest = read_manifest(bucket, manifest_path)
+    same_layout = manifest is not None and manifest["num_shards"] == num_shards and manifest["id_col"] == id_col
+    version = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    ts = datetime.utcnow().isoformat()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            landing_parts, rows = sharding.partition_csv([landing_local], id_col, num_shards, tmp_dir, prefix="landing")
+            os.remove(landing_local)
+            if landing_parts is None:
+                raise ValueError("Landing file is empty")
+            append_step_log_buffer(entity, new_file, "partition_landing", "success", f"Partitioned into {num_shards} shards", rows=rows, duration_sec=time.time() - start)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "partition_landing", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "download_or_read_failed"}
+
+        # Anciennes versions : shards publiés si le découpage est identique, sinon re-partitionnement local
+        old_parts = [None] * num_shards
+        old_sources = []
+        if manifest is not None and not same_layout:
+            old_sources = [shard["path"] for shard in manifest["shards"]]
+        elif manifest is None and bucket.blob(master_path).exists():
+            old_sources = [master_path]
+        if old_sources:
+            old_dir = os.path.join(tmp_dir, "old")
+            os.makedirs(old_dir)
+            old_files = []
+            for n, source in enumerate(old_sources):
+                old_files.append(os.path.join(old_dir, f"source-{n:05d}.csv"))
+                download_to_local(bucket, source, old_files[-1])
+            parts, _ = sharding.partition_csv(old_files, id_col, num_shards, old_dir, prefix="old")
+            if parts is not None:
+                old_parts = parts
+            append_step_log_buffer(entity, master_path, "partition_master", "success", f"Repartitioned {len(old_sources)} existing master object(s)")
+
+        shard_compression = get_master_compression(entity)
+        tasks = []
+        for i in range(num_shards):
+            task = {
+                "bucket_name": BUCKET,
+                "entity": entity,
+                "id_col": id_col,
+                "index": i,
+                "landing_path": landing_parts[i],
+                "output_path": sharding.shard_path(entity, version, i, num_shards, shard_compression),
+                "old_path": None,
+                "old_hash": None,
+                "old_local_path": old_parts[i],
+                "source_file": new_file,
+                "ts": ts,
+                "changes_day": changelog.partition_day(new_file, ts),
+                "changes_name": f"{changelog.changes_name(new_file, version)}_part-{i:05d}",
+            }
+            if same_layout:
+                task["old_path"] = manifest["shards"][i]["path"]
+                task["old_hash"] = manifest["shards"][i]["hash"]
+                task["old_key_index"] = manifest["shards"][i].get("key_index")
+                task["old_bloom_filter"] = manifest["shards"][i].get("bloom_filter")
+            tasks.append(task)
+
+        merge_start = time.time()
+        try:
+            results = run_shard_merges(tasks)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "merge_shards", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "shard_merge_failed"}
+
+    changes = {key: sum(r[key] for r in results) for key in ("inserted", "updated", "deleted")}
+    changed_shards = sum(1 for r in results if r["changed"])
+    uploaded = sum(r.get("bytes_transferred", 0) for r in results)
+    append_step_log_buffer(entity, new_file, "merge_shards", "success", f"{changed_shards}/{num_shards} shards changed - {json.dumps(changes)} - {uploaded} bytes uploaded", rows=rows, duration_sec=time.time() - merge_start)
+
+    if same_layout and changed_shards == 0:
+        append_step_log_buffer(entity, new_file, "compare_hash", "success", "No changes detected")
+        flush_step_logs(bucket, entity)
+        return {"action": "unchanged", "reason": "identical_content"}
+
+    # Publication : tous les shards sont visibles en même temps via le manifest
+    new_manifest = {
+        "version": version,
+        "entity": entity,
+        "id_col": id_col,
+        "num_shards": num_shards,
+        "source_file": new_file,
+        "rows": rows,
+        # Empreinte du fichier d'arrivée, comparée avant fusion au prochain événement
+        "fingerprint": new_hash,
+        "shards": [
+            {"index": r["index"], "path": r["path"], "rows": r["rows"], "hash": r["hash"], "key_index": r["key_index"], "bloom_filter": r["bloom_filter"]}
+            for r in results
+        ],
+    }
+    history_path = None
+    if manifest is not None:
+        history_path = move_to_history(bucket, manifest_path, entity)
+    elif old_sources:
+        # Premier passage au découpage : le master unique est archivé, le manifest le remplace
+        history_path = move_to_history(bucket, master_path, entity)
+    try:
+        bucket.blob(manifest_path).upload_from_string(json.dumps(new_manifest, indent=2), 'application/json')
+        append_step_log_buffer(entity, manifest_path, "update_master", "success", f"Published master version {version}")
+    except Exception as e:
+        append_step_log_buffer(entity, manifest_path, "update_master", "failure", str(e))
+        flush_step_logs(bucket, entity)
+        return {"action": "error", "reason": "upload_failed"}
+
+    clean_history(bucket, entity, max_versions=5)
+    clean_shard_versions(bucket, entity, new_manifest)
+    change_paths, changelog_bq_status = write_changes(bucket, entity, new_file, lambda: [r["changes_path"] for r in results])
+
+    bq_table_map = {
+        "customers": "customers_master",
+        "products": "products_master",
+        "suppliers": "suppliers_master"
+    }
+    gcs_uris = [f"gs://{BUCKET}/{shard['path']}" for shard in new_manifest["shards"]]
+    try:
+        bq_success = load_csv_to_bigquery("retail", bq_table_map[entity], gcs_uris)
+        bq_status = "success" if bq_success else "partial_failure"
+        append_step_log_buffer(entity, manifest_path, "bigquery_overall", "success" if bq_success else "warning", f"BigQuery load from {num_shards} shards: {bq_status}")
+    except Exception as e:
+        append_step_log_buffer(entity, manifest_path, "bigquery_overall", "failure", str(e))
+        flush_step_logs(bucket, entity)
+        return {"action": "error", "reason": "bigquery_load_failed"}
+
+    duration = time.time() - start
+    append_step_log_buffer(entity, new_file, "total_mastering_time", "success", f"Total mastering duration: {duration:.2f} sec", duration_sec=duration)
+    flush_step_logs(bucket, entity)
+
+    return {
+        "action": "created" if manifest is None and not old_sources else "mastered",
+        "rows": rows,
+        "changes": changes,
+        "changed_shards": changed_shards,
+        "current_master": manifest_path,
+        "version": version,
+        "history": history_path,
+        "bigquery_status": bq_status,
+        "changelog": change_paths,
+        "changelog_bigquery_status": changelog_bq_status,
+        "field_changes": sum(r["field_changes"] for r in results)
+    }
+
+def quarantine_path_for(source_file):
+    stem, ext = compression.split_extension(os.path.basename(source_file))
+    return f"quarantine/{source_file.split('/', 1)[0]}/{stem}_orphans{ext}"
+
+def process_orders_validation(new_file):
+    client = storage.Client()
+    bucket = client.bucket(BUCKET)
+    entity = "orders"
+
+    logger.info(f"Starting referential integrity validation of {new_file}")
+    append_step_log_buffer(entity, new_file, "start_validation", "success", "Starting referential integrity validation")
+    start = time.time()
+
+    # Clés des masters chargées une seule fois en tableaux triés
+    keys_by_column = {}
+    for column, (master_entity, id_col) in referential_integrity.REFERENCES.items():
+        try:
+            keys = master_lookup.master_keys(bucket, master_entity, id_col)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "load_master_keys", "failure", f"{master_entity}: {str(e)}")
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "master_keys_failed"}
+        if keys is None:
+            append_step_log_buffer(entity, new_file, "load_master_keys", "warning", f"No {master_entity} master, {column} not checked")
+            continue
+        keys_by_column[column] = keys
+        append_step_log_buffer(entity, new_file, "load_master_keys", "success", f"Loaded {master_entity} master keys", rows=len(keys), duration_sec=time.time() - start)
+
+    if not keys_by_column:
+        flush_step_logs(bucket, entity)
+        return {"action": "skipped", "reason": "no_master"}
+
+    quarantine = get_entity_setting(entity, "QUARANTINE_ORPHANS", "false").lower() == "true"
+    sample_size = int(get_entity_setting(entity, "ORPHAN_SAMPLE_SIZE", "20"))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        check_start = time.time()
+        try:
+            local_path = os.path.join(tmp_dir, "orders.csv")
+            download_to_local(bucket, new_file, local_path)
+            quarantine_local = os.path.join(tmp_dir, "orphans.csv") if quarantine else None
+            report = referential_integrity.validate_csv(local_path, keys_by_column, sample_size, quarantine_local)
+        except Exception as e:
+            append_step_log_buffer(entity, new_file, "referential_integrity", "failure", str(e))
+            flush_step_logs(bucket, entity)
+            return {"action": "error", "reason": "validation_failed"}
+        status = "success" if report["orphan_rows"] == 0 else "warning"
+        append_step_log_buffer(entity, new_file, "referential_integrity", status, json.dumps(report["orphans_by_column"]), rows=report["rows"], duration_sec=time.time() - check_start)
+
+        if quarantine_local is not None and report["orphan_rows"]:
+            report["quarantine"] = quarantine_path_for(new_file)
+            try:
+                upload_file(quarantine_local, bucket, report["quarantine"])
+            except Exception:
+                flush_step_logs(bucket, entity)
+                return {"action": "error", "reason": "quarantine_upload_failed"}
+
+    duration = time.time() - start
+    append_step_log_buffer(entity, new_file, "total_validation_time", "success", f"Total validation duration: {duration:.2f} sec", duration_sec=duration)
+    flush_step_logs(bucket, entity)
+    return {"action": "validated" if report["orphan_rows"] == 0 else "orphans_found", **report}
+
 def main(event, context):
     file_name = event.get('name', '')
     logger.info(f"Triggered by file: {file_name}")
 
-    if file_name.startswith("customers/") and file_name.endswith(".csv"):
+    if file_name.startswith("customers/") and compression.is_csv_object(file_name):
         entity, id_col = "customers", "customer_id"
-    elif file_name.startswith("products/") and file_name.endswith(".csv"):
+    elif file_name.startswith("products/") and compression.is_csv_object(file_name):
         entity, id_col = "products", "product_id"
-    elif file_name.startswith("suppliers/") and file_name.endswith(".csv"):
+    elif file_name.startswith("suppliers/") and compression.is_csv_object(file_name):
         entity, id_col = "suppliers", "supplier_id"
+    elif file_name.startswith("orders/") and compression.is_csv_object(file_name):
+        entity, id_col = "orders", None
     else:
         logger.info(f"Ignored file (not relevant): {file_name}")
         return "File not relevant"
@@ -326,15 +981,49 @@ def main(event, context):
     client = storage.Client()
     bucket = client.bucket(BUCKET)
 
-    result = process_mastering(entity, file_name, id_col)
+    # Événements livrés au moins une fois : un objet (nom, génération) déjà traité ou en cours est ignoré
+    # avant tout téléchargement
+    claim = None
+    if event_ledger.ledger_enabled():
+        generation = event.get('generation')
+        if generation is None:
+            blob = bucket.get_blob(file_name)
+            if blob is None:
+                logger.warning(f"File no longer exists, ignored: {file_name}")
+                return "File not found"
+            generation = blob.generation
+        claim, entry = event_ledger.claim(bucket, "consolidate_masters", file_name, generation)
+        if claim is None:
+            logger.info(f"Duplicate event for {file_name} (generation {generation}) skipped: {entry.get('status')}")
+            return f"Skipped {entity}: duplicate event ({entry.get('status')})"
 
-    log_audit(bucket, entity, {
-        "timestamp": datetime.utcnow().isoformat(),
-        "source_file": file_name,
-        "entity": entity,
-        "action": result.get("action"),
-        "details": result
-    })
+    profile = memory_profile.start("consolidate_masters", entity, file_name)
+    result = None
+    try:
+        if entity == "orders":
+            result = process_orders_validation(file_name)
+        else:
+            result = process_mastering(entity, file_name, id_col)
+        profile_path = profile.write(bucket)
+        if profile_path:
+            result["memory_profile"] = profile_path
+
+        log_audit(bucket, entity, {
+            "timestamp": datetime.utcnow().isoformat(),
+            "source_file": file_name,
+            "entity": entity,
+            "action": result.get("action"),
+            "details": result
+        })
+    finally:
+        memory_profile.finish()
+        if claim is not None:
+            # Un échec (exception ou action « error ») libère l'événement : la prochaine livraison le retraitera
+            if result is None or result.get("action") == "error":
+                event_ledger.release(claim)
+            else:
+                event_ledger.complete(claim, entry, result)
 
-    logger.info(f"Mastering {entity} completed with action: {result.get('action')}")
-    return f"Mastering {entity}: {result.get('action')}"
+    stage = "Validating" if entity == "orders" else "Mastering"
+    logger.info(f"{stage} {entity} completed with action: {result.get('action')}")
+    return f"{stage} {entity}: {result.get('action')}"
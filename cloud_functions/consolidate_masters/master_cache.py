@@ -0,0 +1,94 @@
+# Cache des masters parsés, conservé entre les invocations d'une instance chaude
+"""Process-level cache of parsed masters.
+
+Entries are keyed by entity, object path and object generation, and kept
+dictionary-encoded (pandas categories for repetitive columns) to hold more
+masters in MASTER_CACHE_MB. Hits return the encoded frame without converting
+it back: category columns hold the same strings as a dtype=str read. A lookup
+is only valid for the generation returned by a metadata read of the master,
+so a rewritten master is never served stale.
+
+The cache is resident memory of the instance, so it yields to the memory
+budget: `evict` frees entries before an in-memory step is sized, and `put`
+skips an entry larger than the budget left. Least recently used entries are
+evicted first; MASTER_CACHE_MB=0 disables the cache.
+"""
+import os
+from collections import OrderedDict
+
+_cache = None
+
+
+def get_max_bytes():
+    return int(float(os.getenv("MASTER_CACHE_MB", "128")) * 1024 * 1024)
+
+
+def encode(df):
+    # Colonnes quasi uniques (clés, noms) laissées telles quelles : un dictionnaire n'y gagnerait rien
+    return df.astype({column: "category" for column in df.columns if df[column].nunique() < len(df) // 2})
+
+
+class MasterCache:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key):
+        _, size = self.entries.pop(key)
+        self.size_bytes -= size
+
+    def get(self, entity, path, generation):
+        """Parsed master for this exact generation, or None."""
+        key = (entity, path, generation)
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            # Copie superficielle : l'appelant peut remplacer des colonnes sans toucher à l'entrée
+            return self.entries[key][0].copy(deep=False)
+        self.misses += 1
+        return None
+
+    def put(self, entity, path, generation, df, available_bytes=None):
+        """Cache a master; `available_bytes` is the memory budget left for it (None without budget)."""
+        # Une seule version par entité : les générations précédentes ne seront plus demandées
+        for key in [key for key in self.entries if key[0] == entity]:
+            self._drop(key)
+        if generation is None or self.max_bytes <= 0:
+            return False
+        encoded = encode(df)
+        size = int(encoded.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes or (available_bytes is not None and size > available_bytes):
+            return False
+        while self.size_bytes + size > self.max_bytes:
+            self._drop(next(iter(self.entries)))
+        self.entries[(entity, path, generation)] = (encoded, size)
+        self.size_bytes += size
+        return True
+
+    def evict(self, needed_bytes, keep=None):
+        """Drop entries until `needed_bytes` are freed, the entity `keep` last; returns the bytes freed."""
+        freed = 0
+        for key in sorted(self.entries, key=lambda key: key[0] == keep):
+            if freed >= needed_bytes:
+                break
+            freed += self.entries[key][1]
+            self._drop(key)
+        return freed
+
+    def clear(self):
+        self.entries.clear()
+        self.size_bytes = 0
+
+    def stats(self):
+        return f"hits={self.hits} misses={self.misses} entries={len(self.entries)} size={self.size_bytes / 1024 / 1024:.1f}/{self.max_bytes / 1024 / 1024:.0f} MB"
+
+
+def current():
+    """Cache of this process, created on first use."""
+    global _cache
+    if _cache is None:
+        _cache = MasterCache(get_max_bytes())
+    return _cache
@@ -0,0 +1,155 @@
+# Lecture ponctuelle des masters à partir de leur index de clés
+"""Point lookups on the current master of an entity.
+
+Membership checks only download the Bloom filter and, for its positives,
+the key index and the index pages those keys hash to. `get_records` then
+fetches only the row groups holding the requested keys, pinned to the
+generation the index was read for.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from shared import compression, transfer
+from shared import storage_backend as storage
+
+import key_index
+import sharding
+
+
+def master_parts(bucket, entity, keys):
+    """Current master objects of an entity, each with the requested keys it may hold.
+
+    Yields (object path, generation, sidecar metadata, keys). Sharded masters
+    route keys to their shard the same way the mastering does.
+    """
+    manifest_blob = bucket.blob(f"master/{entity}/{entity}_master_manifest.json")
+    if manifest_blob.exists():
+        manifest = json.loads(manifest_blob.download_as_text())
+        ids = sharding.shard_ids(pd.Series(keys, dtype=str), manifest["num_shards"])
+        for shard in manifest["shards"]:
+            shard_keys = [key for key, shard_id in zip(keys, ids) if shard_id == shard["index"]]
+            if shard_keys:
+                if "key_index" not in shard:
+                    raise LookupError(f"Shard {shard['path']} has no key index")
+                yield shard["path"], None, shard, shard_keys
+        return
+    for ext in compression.EXTENSIONS.values():
+        blob = bucket.get_blob(f"master/{entity}/{entity}_master.csv{ext}")
+        if blob is not None:
+            if not (blob.metadata or {}).get("key_index"):
+                raise LookupError(f"Master {blob.name} has no key index")
+            yield blob.name, blob.generation, blob.metadata, list(keys)
+            return
+    raise LookupError(f"No master found for entity '{entity}'")
+
+
+def current_master_objects(bucket, entity):
+    """(object path, sidecar metadata) of each object of the current master; empty without master."""
+    manifest_blob = bucket.blob(f"master/{entity}/{entity}_master_manifest.json")
+    if manifest_blob.exists():
+        return [(shard["path"], shard) for shard in json.loads(manifest_blob.download_as_text())["shards"]]
+    for ext in compression.EXTENSIONS.values():
+        blob = bucket.get_blob(f"master/{entity}/{entity}_master.csv{ext}")
+        if blob is not None:
+            return [(blob.name, blob.metadata or {})]
+    return []
+
+
+def _read_key_column(bucket, path, id_col):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        local_path = os.path.join(tmp_dir, os.path.basename(path))
+        transfer.download_to_filename(bucket.blob(path), local_path)
+        chunks = pd.read_csv(local_path, usecols=[id_col], dtype=str, keep_default_na=False, chunksize=1_000_000)
+        return np.concatenate([chunk[id_col].to_numpy(dtype=str) for chunk in chunks] or [np.array([], dtype=str)])
+
+
+def master_keys(bucket, entity, id_col):
+    """Sorted unique keys of the current master, or None without master.
+
+    Keys come from the key indexes when published, otherwise from the key column of the master body.
+    """
+    objects = current_master_objects(bucket, entity)
+    if not objects:
+        return None
+    parts = []
+    for path, sidecars in objects:
+        if sidecars.get("key_index"):
+            # Toutes les clés sont demandées : toutes les pages sont lues
+            index = key_index.load_index(bucket, sidecars["key_index"])
+            parts.append(np.array(key_index.load_all_keys(bucket, sidecars["key_index"], index), dtype=str))
+        else:
+            parts.append(_read_key_column(bucket, path, id_col))
+    return np.unique(np.concatenate(parts))
+
+
+def contains(entity, keys, bucket_name=None):
+    """{key: bool} membership of keys in the current master, from its sidecars only."""
+    bucket = storage.Client().bucket(bucket_name or os.getenv("RETAIL_DATA_LANDING_ZONE_BUCKET"))
+    keys = [str(key) for key in keys]
+    found = dict.fromkeys(keys, False)
+    for _, _, sidecars, part_keys in master_parts(bucket, entity, keys):
+        bloom = key_index.load_bloom(bucket, sidecars["bloom_filter"])
+        candidates = [key for key in part_keys if key in bloom]
+        if candidates:
+            # Le filtre de Bloom peut se tromper sur un positif : les pages de l'index tranchent
+            index = key_index.load_index(bucket, sidecars["key_index"])
+            for key in key_index.load_key_groups(bucket, sidecars["key_index"], index, candidates):
+                found[key] = True
+    return found
+
+
+def _read_group(blob, index, group, generation):
+    offset, length = index["row_groups"][group]
+    data = blob.download_as_bytes(start=offset, end=offset + length - 1, if_generation_match=generation)
+    if index["compression"] == "gzip":
+        data = gzip.decompress(data)
+    return csv.reader(io.StringIO(data.decode("utf-8")))
+
+
+def get_records(entity, keys, bucket_name=None):
+    """{key: row} for the keys present in the current master; rows are dicts of strings.
+
+    Only the Bloom filter, the index, the index pages of the keys and the row
+    groups holding them are downloaded.
+    """
+    bucket = storage.Client().bucket(bucket_name or os.getenv("RETAIL_DATA_LANDING_ZONE_BUCKET"))
+    keys = [str(key) for key in keys]
+    records = {}
+    for path, generation, sidecars, part_keys in master_parts(bucket, entity, keys):
+        bloom = key_index.load_bloom(bucket, sidecars["bloom_filter"])
+        candidates = [key for key in part_keys if key in bloom]
+        if not candidates:
+            continue
+        index = key_index.load_index(bucket, sidecars["key_index"])
+        groups = {}
+        for key, group in key_index.load_key_groups(bucket, sidecars["key_index"], index, candidates).items():
+            groups.setdefault(group, set()).add(key)
+        if not groups:
+            continue
+        blob = bucket.blob(path)
+        if generation is None:
+            blob.reload()
+            generation = blob.generation
+        key_col = index["header"].index(index["id_col"])
+
+        def read(group):
+            return [row for row in _read_group(blob, index, group, generation) if row[key_col] in groups[group]]
+
+        with ThreadPoolExecutor(max_workers=min(8, len(groups))) as executor:
+            for rows in executor.map(read, groups):
+                for row in rows:
+                    records[row[key_col]] = dict(zip(index["header"], row))
+    return records
+
+
+def get_record(entity, key, bucket_name=None):
+    """Row of the current master for `key`, or None."""
+    return get_records(entity, [key], bucket_name).get(str(key))
@@ -0,0 +1,62 @@
+# Contrôle d'intégrité référentielle des commandes contre les masters
+"""Vectorized check that every reference of an orders file exists in its master.
+
+Master keys are loaded once as sorted arrays; each chunk of orders is then
+checked with one binary search per column (numpy.searchsorted), so the
+cost stays linear in the number of order rows without any per-row lookup.
+"""
+import numpy as np
+import pandas as pd
+
+# Colonne des commandes -> (entité du master, clé du master)
+REFERENCES = {
+    "customer_id": ("customers", "customer_id"),
+    "product_id": ("products", "product_id"),
+}
+
+VALIDATION_CHUNK_ROWS = 1_000_000
+
+
+def missing_keys(values, sorted_keys):
+    """Boolean mask of the values absent from the sorted key array."""
+    values = np.asarray(values, dtype=str)
+    if len(sorted_keys) == 0:
+        return np.ones(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_keys, values)
+    positions[positions == len(sorted_keys)] = 0
+    return sorted_keys[positions] != values
+
+
+def validate_csv(path, keys_by_column, sample_size=20, quarantine_path=None, chunk_rows=VALIDATION_CHUNK_ROWS):
+    """Check the reference columns of a local CSV against master keys, chunk by chunk.
+
+    Returns counts per column and a sample of orphaned rows; every orphaned
+    row is also written to `quarantine_path` when given.
+    """
+    report = {"rows": 0, "orphan_rows": 0, "orphans_by_column": dict.fromkeys(keys_by_column, 0), "sample": []}
+    quarantine_started = False
+    for chunk in pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_rows):
+        orphaned = np.zeros(len(chunk), dtype=bool)
+        missing_by_column = {}
+        for column, keys in keys_by_column.items():
+            if column not in chunk.columns:
+                raise ValueError(f"Column '{column}' not found in {path}")
+            missing = missing_keys(chunk[column].to_numpy(), keys)
+            report["orphans_by_column"][column] += int(missing.sum())
+            missing_by_column[column] = missing
+            orphaned |= missing
+        report["rows"] += len(chunk)
+        report["orphan_rows"] += int(orphaned.sum())
+
+        if not orphaned.any():
+            continue
+        room = sample_size - len(report["sample"])
+        if room > 0:
+            for position in np.flatnonzero(orphaned)[:room]:
+                row = chunk.iloc[position].to_dict()
+                row["missing_references"] = [column for column, missing in missing_by_column.items() if missing[position]]
+                report["sample"].append(row)
+        if quarantine_path is not None:
+            chunk[orphaned].to_csv(quarantine_path, mode="a" if quarantine_started else "w", header=not quarantine_started, index=False)
+            quarantine_started = True
+    return report
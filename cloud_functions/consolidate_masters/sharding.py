@@ -0,0 +1,119 @@
+# Partitionnement des masters par hash de la clé d'entité
+import pandas as pd
+import hashlib
+import io
+import os
+
+from shared import changelog, compression
+from shared import storage_backend as storage
+
+import key_index
+
+PARTITION_CHUNK_ROWS = 200_000
+
+
+def shard_path(entity, version, index, num_shards, shard_compression="none"):
+    """Object path of one shard of a published master version."""
+    return compression.csv_path(f"master/{entity}/shards/{version}/part-{index:05d}-of-{num_shards:05d}", shard_compression)
+
+
+def shard_ids(keys, num_shards):
+    """Stable shard number for each key (same result in every process)."""
+    hashes = pd.util.hash_pandas_object(keys.astype(str), index=False).to_numpy()
+    return hashes % num_shards
+
+
+def read_shard_csv(source):
+    """Read a shard as strings so values are written back byte for byte."""
+    return pd.read_csv(source, dtype=str, keep_default_na=False)
+
+
+def iter_csv_chunks(sources):
+    for source in sources:
+        yield from pd.read_csv(source, dtype=str, keep_default_na=False, chunksize=PARTITION_CHUNK_ROWS)
+
+
+def partition_csv(sources, id_col, num_shards, out_dir, prefix="part"):
+    """Split CSV files into num_shards local files by hash of id_col, chunk by chunk."""
+    paths = [os.path.join(out_dir, f"{prefix}-{i:05d}.csv") for i in range(num_shards)]
+    rows = 0
+    columns = None
+    for chunk in iter_csv_chunks(sources):
+        if columns is None:
+            # Chaque shard a au moins l'en-tête, même s'il ne reçoit aucune ligne
+            columns = list(chunk.columns)
+            for path in paths:
+                chunk.iloc[0:0].to_csv(path, index=False)
+        chunk = chunk.reindex(columns=columns, fill_value="")
+        ids = shard_ids(chunk[id_col], num_shards)
+        for index, part in chunk.groupby(ids, sort=False):
+            part.to_csv(paths[index], mode="a", header=False, index=False)
+        rows += len(chunk)
+    if columns is None:
+        return None, 0
+    return paths, rows
+
+
+def shard_to_csv(df, id_col):
+    """Canonical CSV of a shard: rows ordered by key so the hash is reproducible."""
+    df_sorted = df.sort_values(by=id_col, kind="mergesort")
+    data = df_sorted.to_csv(index=False)
+    return data, hashlib.md5(data.encode()).hexdigest()
+
+
+def compare_shards(old_df, new_df, id_col):
+    """Count inserted, updated and deleted keys between two versions of a shard."""
+    old_idx = old_df.drop_duplicates(subset=id_col, keep="last").set_index(id_col)
+    new_idx = new_df.drop_duplicates(subset=id_col, keep="last").set_index(id_col)
+    common = old_idx.index.intersection(new_idx.index)
+    if list(old_idx.columns) == list(new_idx.columns):
+        updated = int((old_idx.loc[common] != new_idx.loc[common]).any(axis=1).sum())
+    else:
+        updated = len(common)
+    return {
+        "inserted": int(len(new_idx.index.difference(old_idx.index))),
+        "updated": updated,
+        "deleted": int(len(old_idx.index.difference(new_idx.index))),
+    }
+
+
+def merge_shard(task):
+    """Merge one landing shard into its master shard and upload it if it changed.
+
+    Field-level changes of the shard go to their own change-log object.
+    Runs in a worker process, so it opens its own storage client.
+    """
+    new_df = read_shard_csv(task["landing_path"])
+    data, new_hash = shard_to_csv(new_df, task["id_col"])
+    result = {"index": task["index"], "rows": len(new_df), "hash": new_hash}
+
+    # Un shard inchangé mais publié sans index est réécrit pour recevoir le sien
+    if task.get("old_hash") == new_hash and task.get("old_key_index"):
+        result.update({"changed": False, "path": task["old_path"], "inserted": 0, "updated": 0, "deleted": 0, "field_changes": 0, "changes_path": None})
+        result.update({"key_index": task["old_key_index"], "bloom_filter": task["old_bloom_filter"]})
+        return result
+
+    bucket = storage.Client().bucket(task["bucket_name"])
+    if task.get("old_path"):
+        data_old = bucket.blob(task["old_path"]).download_as_bytes()
+        data_old = compression.decompress_bytes(data_old, compression.compression_from_path(task["old_path"]))
+        old_df = read_shard_csv(io.BytesIO(data_old))
+    elif task.get("old_local_path"):
+        old_df = read_shard_csv(task["old_local_path"])
+    else:
+        old_df = new_df.iloc[0:0]
+    result.update(compare_shards(old_df.drop(columns=[changelog.CHANGE_COUNT_COLUMN], errors="ignore"), new_df, task["id_col"]))
+    changes = changelog.diff_frames(old_df, new_df, task["id_col"], task["ts"], task["source_file"])
+    result["field_changes"] = len(changes)
+    result["changes_path"] = changelog.write_changes(bucket, task["entity"], changes, task["changes_day"], task["changes_name"])
+    # Le hash du shard porte sur les valeurs d'arrivée ; le compteur n'est ajouté qu'à l'écriture
+    data, _ = shard_to_csv(changelog.with_change_counts(new_df, old_df, task["id_col"], changes), task["id_col"])
+
+    shard_compression = compression.compression_from_path(task["output_path"])
+    payload = io.BytesIO()
+    index, bloom = key_index.write_indexed(io.StringIO(data), task["id_col"], payload, shard_compression)
+    bucket.blob(task["output_path"]).upload_from_string(payload.getvalue(), compression.CONTENT_TYPES[shard_compression])
+    result.update(key_index.upload_sidecars(bucket, task["output_path"], index, bloom))
+    result["bytes_transferred"] = len(payload.getvalue())
+    result.update({"changed": True, "path": task["output_path"]})
+    return result
@@ -2,9 +2,10 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import random
-import json
 from faker import Faker
-from google.cloud import storage
+
+from shared import compression, memory_profile, utils
+from shared import storage_backend as storage
 
 def get_excluded_countries():
     # List of countries to exclude from customer generation
@@ -19,15 +20,7 @@ currency_map = {
     'New Zealand': 'NZD', 'Japan': 'JPY', 'South Korea': 'KRW', 'Brazil': 'BRL', 'Mexico': 'MXN'
 }
 
-def upload_to_gcs(df, bucket_name, folder, filename):
-    # Uploads a DataFrame as a CSV file to Google Cloud Storage
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(f"{folder}/{filename}")
-    blob.upload_from_string(df.to_csv(index=False), 'text/csv')
-    print(f"Uploaded {filename} to gs://{bucket_name}/{folder}/")
-
-def generate_initial_b2b_customers(n=10000, fake=None):
+def generate_initial_b2b_customers(n=10000, fake=None, date=None):
     # Generates a DataFrame of B2B customers with realistic data
     excluded_countries = get_excluded_countries()
     valid_countries = []
@@ -35,7 +28,10 @@ def generate_initial_b2b_customers(n=10000, fake=None):
         c = fake.country()
         if c not in excluded_countries:
             valid_countries.append(c)
-    start_date = datetime.now() - timedelta(days=1)  # File for yesterday
+    if date is None:
+        start_date = datetime.now() - timedelta(days=1)  # File for yesterday
+    else:
+        start_date = datetime.combine(date, datetime.min.time())
     data = {
         'customer_id': [],
         'company_name': [],
@@ -51,8 +47,7 @@ def generate_initial_b2b_customers(n=10000, fake=None):
         'created_at': [],
         'last_modified': [],
         'customer_segment': [],
-        'is_active': [],
-        'modification_history': []
+        'is_active': []
     }
     for i, country in enumerate(valid_countries):
         cc = country[:2].upper()
@@ -71,21 +66,34 @@ def generate_initial_b2b_customers(n=10000, fake=None):
         data['last_modified'].append(start_date)
         data['customer_segment'].append(random.choice(['SME', 'Mid-Market', 'Enterprise', 'Startup']))
         data['is_active'].append(random.choice([True, False]))
-        data['modification_history'].append(json.dumps([]))
     df = pd.DataFrame(data)
     return df
 
+def generate_and_upload_customers(bucket_name="retail-data-landing-zone", date=None):
+    # Generates and uploads the customers file for a given date (default: yesterday)
+    fake = Faker()
+    Faker.seed(42)
+    if date is None:
+        date = (datetime.now() - timedelta(days=1)).date()
+    date_str = date.strftime("%Y-%m-%d")
+    profile = memory_profile.start("generate_customers_daily", "customers")
+    try:
+        customers_df = generate_initial_b2b_customers(n=10000, fake=fake, date=date)
+        profile.checkpoint("generate")
+        filename = compression.csv_path(f"customers_{date_str}", compression.get_compression("customers"))
+        transferred, raw = utils.upload_csv_to_gcs(customers_df, bucket_name, f"customers/{filename}")
+        print(f"Uploaded {filename} to gs://{bucket_name}/customers/ ({transferred} bytes transferred, {raw} bytes uncompressed)")
+        profile.checkpoint("upload")
+        profile.write(storage.Client().bucket(bucket_name))
+    finally:
+        memory_profile.finish()
+    print(f"Daily customers file generated for {date_str}")
+    return date_str
+
 def generate_customers_daily(request):
     """
     Cloud Function entry point for generating the daily customers file.
     This function generates a new customers file for the previous day and uploads it to Google Cloud Storage.
     """
-    fake = Faker()
-    Faker.seed(42)
-    bucket_name = "retail-data-landing-zone"
-    yesterday = datetime.now() - timedelta(days=1)
-    date_str = yesterday.strftime("%Y-%m-%d")
-    customers_df = generate_initial_b2b_customers(n=10000, fake=fake)
-    upload_to_gcs(customers_df, bucket_name, "customers", f"customers_{date_str}.csv")
-    print(f"Daily customers file generated for {date_str}")
+    date_str = generate_and_upload_customers("retail-data-landing-zone")
     return f"Daily customers file generated for {date_str}"
@@ -3,24 +3,21 @@ import numpy as np
 from datetime import datetime, timedelta
 import random
 from faker import Faker
-from google.cloud import storage
+
+from shared import compression, memory_profile, utils
+from shared import storage_backend as storage
 
 fake = Faker()
 Faker.seed(42)
 
-def upload_to_gcs(df, bucket_name, folder, filename):
-    # Uploads a DataFrame as a CSV file to Google Cloud Storage
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(f"{folder}/{filename}")
-    blob.upload_from_string(df.to_csv(index=False), 'text/csv')
-    print(f"Uploaded {filename} to gs://{bucket_name}/{folder}/")
-
-def generate_products(n=2000):
+def generate_products(n=2000, date=None):
     # Generates a DataFrame of products with realistic data
     product_ids = [f"P{str(i).zfill(5)}" for i in range(1, n+1)]
     categories = ['Computers', 'Components', 'Accessories']
-    yesterday = datetime.now() - timedelta(days=1)
+    if date is None:
+        yesterday = datetime.now() - timedelta(days=1)
+    else:
+        yesterday = datetime.combine(date, datetime.min.time())
     data = {
         'product_id': product_ids,
         'product_name': [fake.word().capitalize() + " " + random.choice(['Pro', 'Plus', 'Max', 'Lite', 'Go']) for _ in range(n)],
@@ -34,15 +31,29 @@ def generate_products(n=2000):
     df = pd.DataFrame(data)
     return df
 
+def generate_and_upload_products(bucket_name="retail-data-landing-zone", date=None):
+    # Generates and uploads the products file for a given date (default: yesterday)
+    if date is None:
+        date = (datetime.now() - timedelta(days=1)).date()
+    date_str = date.strftime("%Y-%m-%d")
+    profile = memory_profile.start("generate_products_daily", "products")
+    try:
+        products_df = generate_products(date=date)
+        profile.checkpoint("generate")
+        filename = compression.csv_path(f"products_{date_str}", compression.get_compression("products"))
+        transferred, raw = utils.upload_csv_to_gcs(products_df, bucket_name, f"products/{filename}")
+        print(f"Uploaded {filename} to gs://{bucket_name}/products/ ({transferred} bytes transferred, {raw} bytes uncompressed)")
+        profile.checkpoint("upload")
+        profile.write(storage.Client().bucket(bucket_name))
+    finally:
+        memory_profile.finish()
+    print(f"Daily products file generated for {date_str}")
+    return date_str
+
 def generate_products_daily(request):
     """
     Cloud Function entry point for generating the daily products file.
     This function generates a new products file for the previous day and uploads it to Google Cloud Storage.
     """
-    bucket_name = "retail-data-landing-zone"
-    yesterday = datetime.now() - timedelta(days=1)
-    date_str = yesterday.strftime("%Y-%m-%d")
-    products_df = generate_products()
-    upload_to_gcs(products_df, bucket_name, "products", f"products_{date_str}.csv")
-    print(f"Daily products file generated for {date_str}")
+    date_str = generate_and_upload_products("retail-data-landing-zone")
     return f"Daily products file generated for {date_str}"
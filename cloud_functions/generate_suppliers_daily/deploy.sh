@@ -10,6 +10,11 @@ SERVICE_ACCOUNT="generate-suppliers-daily-sa@${PROJECT_ID}.iam.gserviceaccount.c
 
 echo "Deploying ${FUNCTION_NAME}..."
 
+# Embarque le module partagé dans les sources déployées
+rm -rf shared
+cp -r ../shared shared
+trap 'rm -rf shared' EXIT
+
 gcloud functions deploy ${FUNCTION_NAME} \
   --runtime python310 \
   --trigger-http \
@@ -1,12 +1,13 @@
 import pandas as pd
 import random
-import json
 from faker import Faker
-from google.cloud import storage
 from io import StringIO
 from datetime import datetime, timedelta, timezone
 import os
 
+from shared import compression, memory_profile, utils
+from shared import storage_backend as storage
+
 fake = Faker()
 Faker.seed(42)
 
@@ -15,14 +16,6 @@ SUPPLIER_SERVICES = [
     "Catering", "Maintenance", "Construction", "Telecom", "Marketing", "HR", "Logistics"
 ]
 
-def upload_to_gcs(df, bucket_name, folder, filename):
-    """Upload a DataFrame as CSV to a GCS bucket."""
-    client = storage.Client()
-    bucket = client.bucket(bucket_name)
-    blob = bucket.blob(f"{folder}/{filename}")
-    blob.upload_from_string(df.to_csv(index=False), 'text/csv')
-    print(f"Uploaded {filename} to gs://{bucket_name}/{folder}/")
-
 def generate_supplier_id(i):
     """Generate a supplier ID."""
     return f"S{str(i).zfill(6)}"
@@ -44,8 +37,7 @@ def generate_suppliers(n=500, duplicate_rate=0.05, date=None):
         'phone': [fake.phone_number() for _ in range(n)],
         'created_at': [date for _ in range(n)],
         'last_modified': [date for _ in range(n)],
-        'is_active': [random.choice([True, False]) for _ in range(n)],
-        'modification_history': [json.dumps([]) for _ in range(n)]
+        'is_active': [random.choice([True, False]) for _ in range(n)]
     }
     df = pd.DataFrame(data)
 
@@ -55,21 +47,13 @@ def generate_suppliers(n=500, duplicate_rate=0.05, date=None):
         duplicate_indices = random.sample(range(n), n_duplicates)
         duplicates = df.loc[duplicate_indices].copy()
         for idx in duplicates.index:
-            hist = []
             now = datetime.now()
             # Simulate a modification
             if random.random() < 0.5:
-                old_address = duplicates.at[idx, 'address']
-                new_address = fake.street_address()
-                duplicates.at[idx, 'address'] = new_address
-                hist.append({'date': now.isoformat(), 'field': 'address', 'old': old_address, 'new': new_address})
+                duplicates.at[idx, 'address'] = fake.street_address()
             else:
-                old_name = duplicates.at[idx, 'company_name']
-                new_name = fake.company() + " " + random.choice(['SAS', 'SARL', 'SA', 'GmbH', 'Ltd'])
-                duplicates.at[idx, 'company_name'] = new_name
-                hist.append({'date': now.isoformat(), 'field': 'company_name', 'old': old_name, 'new': new_name})
+                duplicates.at[idx, 'company_name'] = fake.company() + " " + random.choice(['SAS', 'SARL', 'SA', 'GmbH', 'Ltd'])
             duplicates.at[idx, 'last_modified'] = now
-            duplicates.at[idx, 'modification_history'] = json.dumps(hist)
             duplicates.at[idx, 'supplier_id'] = f"DUP{str(idx).zfill(6)}"
         df = pd.concat([df, duplicates], ignore_index=True)
     return df
@@ -80,9 +64,17 @@ def generate_and_upload_suppliers(bucket_name="retail-data-landing-zone", date=N
         date = (datetime.utcnow() - timedelta(days=1)).date()  # Use yesterday's date by default
     date_str = date.strftime("%Y-%m-%d")
     folder = "suppliers"
-    filename = f"suppliers_{date_str}.csv"
-    suppliers_df = generate_suppliers(n=500, duplicate_rate=0.05, date=date)
-    upload_to_gcs(suppliers_df, bucket_name, folder, filename)
+    filename = compression.csv_path(f"suppliers_{date_str}", compression.get_compression("suppliers"))
+    profile = memory_profile.start("generate_suppliers_daily", "suppliers")
+    try:
+        suppliers_df = generate_suppliers(n=500, duplicate_rate=0.05, date=date)
+        profile.checkpoint("generate")
+        transferred, raw = utils.upload_csv_to_gcs(suppliers_df, bucket_name, f"{folder}/{filename}")
+        print(f"Uploaded {filename} to gs://{bucket_name}/{folder}/ ({transferred} bytes transferred, {raw} bytes uncompressed)")
+        profile.checkpoint("upload")
+        profile.write(storage.Client().bucket(bucket_name))
+    finally:
+        memory_profile.finish()
     print(f"Suppliers generated and uploaded for {date_str} ({len(suppliers_df)} records)")
 
 # Cloud Function entry point
@@ -0,0 +1,147 @@
+# cloud_functions/shared/changelog.py
+"""Field-level change log of the masters, in long format.
+
+One row per changed field (key, field, old, new, ts, source_file), written
+under changelog/<entity>/date=<YYYY-MM-DD>/ so that the log can be read or
+loaded one day partition at a time. Master rows only carry a change_count
+column; `history_json` rebuilds the former modification_history JSON view
+from the log when it is needed.
+"""
+import io
+import itertools
+import json
+import os
+import re
+
+import pandas as pd
+
+from shared import compression, transfer
+
+COLUMNS = ["key", "field", "old", "new", "ts", "source_file"]
+CHANGE_COUNT_COLUMN = "change_count"
+# Colonnes techniques jamais tracées champ par champ
+UNTRACKED_COLUMNS = {CHANGE_COUNT_COLUMN, "last_modified", "modification_history"}
+
+
+def changelog_path(entity, day, name):
+    return compression.csv_path(f"changelog/{entity}/date={day}/{name}", compression.get_compression(entity))
+
+
+def partition_day(source_file, ts):
+    """Day partition of the changes brought by a landing file: the date in its name, else the day of ts."""
+    match = re.search(r"\d{4}-\d{2}-\d{2}", os.path.basename(source_file))
+    return match.group(0) if match else ts[:10]
+
+
+def changes_name(source_file, version):
+    """Change-log object name of one landing file processed as one master version."""
+    stem, _ = compression.split_extension(os.path.basename(source_file))
+    return f"{stem}_changes_{version}"
+
+
+def tracked_columns(old_columns, new_columns):
+    return [column for column in new_columns if column in old_columns and column not in UNTRACKED_COLUMNS]
+
+
+def diff_frames(old_df, new_df, id_col, ts, source_file):
+    """Changes between two versions of a master, one row per (key, changed field).
+
+    Keys present in both versions are compared on their last occurrence, as
+    strings; either frame may hold categorical columns (cached masters).
+    """
+    old_idx = old_df.drop_duplicates(subset=id_col, keep="last").set_index(id_col)
+    new_idx = new_df.drop_duplicates(subset=id_col, keep="last").set_index(id_col)
+    common = old_idx.index.intersection(new_idx.index)
+    columns = tracked_columns(old_idx.columns, new_idx.columns)
+    # Passage par object : les colonnes catégorielles n'acceptent pas "" comme valeur de remplacement
+    old_values = old_idx.loc[common, columns].astype(object).fillna("").astype(str)
+    new_values = new_idx.loc[common, columns].astype(object).fillna("").astype(str)
+    changed = (old_values != new_values).stack()
+    changed = changed[changed]
+    if changed.empty:
+        return pd.DataFrame(columns=COLUMNS)
+    keys = changed.index.get_level_values(0)
+    fields = changed.index.get_level_values(1)
+    return pd.DataFrame({
+        "key": keys.astype(str),
+        "field": fields,
+        "old": old_values.stack()[changed.index].to_numpy(),
+        "new": new_values.stack()[changed.index].to_numpy(),
+        "ts": ts,
+        "source_file": source_file,
+    })
+
+
+def diff_rows(key, fields, old_row, new_row, ts, source_file):
+    """Changes between two versions of one row, as change-log rows; fields are (name, old index, new index)."""
+    return [
+        [key, name, old_row[old_index], new_row[new_index], ts, source_file]
+        for name, old_index, new_index in fields
+        if old_row[old_index] != new_row[new_index]
+    ]
+
+
+def with_change_counts(new_df, old_df, id_col, changes):
+    """new_df with change_count = previous count of the key + its fields changed in this version."""
+    new_df = new_df.drop(columns=[CHANGE_COUNT_COLUMN], errors="ignore")
+    counts = pd.Series(0, index=new_df[id_col].astype(str).unique(), dtype="int64")
+    if old_df is not None and CHANGE_COUNT_COLUMN in old_df.columns:
+        previous = old_df.drop_duplicates(subset=id_col, keep="last")
+        previous = pd.to_numeric(previous.set_index(previous[id_col].astype(str))[CHANGE_COUNT_COLUMN].astype(object), errors="coerce")
+        counts = counts.add(previous.reindex(counts.index).fillna(0).astype("int64"), fill_value=0)
+    if len(changes):
+        counts = counts.add(changes.groupby("key").size().reindex(counts.index).fillna(0).astype("int64"), fill_value=0)
+    return new_df.assign(**{CHANGE_COUNT_COLUMN: new_df[id_col].astype(str).map(counts).astype("int64").to_numpy()})
+
+
+def write_changes(bucket, entity, changes, day, name):
+    """Upload a DataFrame of changes to the day partition; returns its path, or None when there is nothing to write."""
+    if changes is None or len(changes) == 0:
+        return None
+    path = changelog_path(entity, day, name)
+    object_compression = compression.compression_from_path(path)
+    data = changes[COLUMNS].to_csv(index=False).encode("utf-8")
+    transfer.upload_from_string(bucket, path, compression.compress_bytes(data, object_compression), compression.CONTENT_TYPES[object_compression])
+    return path
+
+
+def upload_changes_file(bucket, entity, local_path, day, name):
+    """Upload a local change-log CSV to the day partition; returns its path, or None when it holds no change."""
+    with open(local_path, newline="") as f:
+        if sum(1 for _ in itertools.islice(f, 2)) < 2:
+            return None
+    path = changelog_path(entity, day, name)
+    object_compression = compression.compression_from_path(path)
+    upload_path = local_path
+    if object_compression != "none":
+        upload_path = local_path + compression.EXTENSIONS[object_compression]
+        compression.compress_file(local_path, upload_path, object_compression)
+    transfer.upload_from_filename(bucket, path, upload_path, compression.CONTENT_TYPES[object_compression])
+    return path
+
+
+def read_changes(bucket, entity, start_day=None, end_day=None):
+    """All changes of an entity, optionally limited to a range of day partitions (inclusive)."""
+    frames = []
+    prefix = f"changelog/{entity}/"
+    for blob in bucket.list_blobs(prefix=prefix):
+        day = blob.name[len(prefix):].split("/", 1)[0].replace("date=", "")
+        if (start_day and day < start_day) or (end_day and day > end_day):
+            continue
+        data = compression.decompress_bytes(transfer.download_as_bytes(blob), compression.compression_from_path(blob.name))
+        frames.append(pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False))
+    if not frames:
+        return pd.DataFrame(columns=COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def history_json(bucket, entity, keys=None):
+    """modification_history as it used to be stored on master rows: {key: JSON list of changes, oldest first}."""
+    changes = read_changes(bucket, entity)
+    if keys is not None:
+        changes = changes[changes["key"].isin([str(key) for key in keys])]
+    changes = changes.sort_values(["key", "ts"], kind="mergesort")
+    return {
+        key: json.dumps([{"date": row.ts, "field": row.field, "old": row.old, "new": row.new} for row in group.itertuples()])
+        for key, group in changes.groupby("key", sort=False)
+    }
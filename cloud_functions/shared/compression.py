@@ -0,0 +1,96 @@
+# cloud_functions/shared/compression.py
+import gzip
+import os
+import shutil
+
+# Extension ajoutée au nom de l'objet pour chaque mode de compression
+EXTENSIONS = {
+    "none": "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+CONTENT_TYPES = {
+    "none": "text/csv",
+    "gzip": "application/gzip",
+    "zstd": "application/zstd",
+}
+
+# Ordre de grandeur du ratio CSV décompressé / compressé, pour estimer l'empreinte mémoire
+SIZE_FACTORS = {
+    "none": 1,
+    "gzip": 5,
+    "zstd": 6,
+}
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression requires the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+def get_compression(entity):
+    """Compression configured for an entity's objects: OBJECT_COMPRESSION_<ENTITY>, then OBJECT_COMPRESSION."""
+    compression = os.getenv(f"OBJECT_COMPRESSION_{entity.upper()}", os.getenv("OBJECT_COMPRESSION", "none")).lower()
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unsupported compression '{compression}', expected one of {sorted(EXTENSIONS)}")
+    return compression
+
+def compression_from_path(path):
+    """Compression of an object, deduced from its extension."""
+    for compression, ext in EXTENSIONS.items():
+        if ext and path.endswith(ext):
+            return compression
+    return "none"
+
+def split_extension(filename):
+    """('customers_master', '.csv.gz') for 'customers_master.csv.gz'."""
+    compression = compression_from_path(filename)
+    if compression != "none":
+        filename = filename[:-len(EXTENSIONS[compression])]
+    stem, ext = os.path.splitext(filename)
+    return stem, ext + EXTENSIONS[compression]
+
+def is_csv_object(path):
+    return any(path.endswith(".csv" + ext) for ext in EXTENSIONS.values())
+
+def csv_path(stem, compression):
+    return f"{stem}.csv{EXTENSIONS[compression]}"
+
+def compress_bytes(data, compression):
+    if compression == "gzip":
+        return gzip.compress(data)
+    if compression == "zstd":
+        return _zstd().ZstdCompressor().compress(data)
+    return data
+
+def decompress_bytes(data, compression):
+    if compression == "gzip":
+        return gzip.decompress(data)
+    if compression == "zstd":
+        return _zstd().ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+def _open_stream(path, mode, compression):
+    if compression == "gzip":
+        return gzip.open(path, mode)
+    if compression == "zstd":
+        zstd = _zstd()
+        raw = open(path, mode)
+        if "r" in mode:
+            return zstd.ZstdDecompressor().stream_reader(raw, closefd=True)
+        return zstd.ZstdCompressor().stream_writer(raw, closefd=True)
+    return open(path, mode)
+
+def decompress_file(src, dst, compression):
+    """Stream-decompress a local file; returns the decompressed size in bytes."""
+    with _open_stream(src, "rb", compression) as fin, open(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    return os.path.getsize(dst)
+
+def compress_file(src, dst, compression):
+    """Stream-compress a local file; returns the compressed size in bytes."""
+    with open(src, "rb") as fin, _open_stream(dst, "wb", compression) as fout:
+        shutil.copyfileobj(fin, fout, 1024 * 1024)
+    return os.path.getsize(dst)
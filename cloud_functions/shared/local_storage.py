@@ -0,0 +1,228 @@
+# cloud_functions/shared/local_storage.py
+"""Filesystem stand-in for the subset of google.cloud.storage used by the pipeline.
+
+Objects live under <root>/<bucket>/<name>, their metadata (generation,
+content type, custom metadata) under <root>/.meta/<bucket>/<name>.json.
+The root defaults to LOCAL_STORAGE_ROOT.
+"""
+import contextlib
+import fcntl
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+
+class Client:
+    def __init__(self, project=None, root=None):
+        self.project = project
+        self.root = os.path.abspath(root or os.getenv("LOCAL_STORAGE_ROOT", ".local_storage"))
+
+    def bucket(self, bucket_name):
+        return Bucket(self, bucket_name)
+
+    def get_bucket(self, bucket_name):
+        return self.bucket(bucket_name)
+
+
+class Bucket:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def _object_path(self, name):
+        return os.path.join(self.client.root, self.name, name)
+
+    def _meta_path(self, name):
+        return os.path.join(self.client.root, ".meta", self.name, name + ".json")
+
+    @contextlib.contextmanager
+    def _lock(self):
+        # Verrou par bucket : les écritures conditionnelles restent atomiques entre processus
+        lock_dir = os.path.join(self.client.root, ".meta")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{self.name}.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def blob(self, blob_name):
+        return Blob(blob_name, self)
+
+    def get_blob(self, blob_name):
+        blob = self.blob(blob_name)
+        try:
+            blob.reload()
+        except NotFound:
+            return None
+        return blob
+
+    def copy_blob(self, blob, destination_bucket, new_name=None):
+        destination = destination_bucket.blob(new_name or blob.name)
+        with open(blob._path(), "rb") as f:
+            destination._write(f, content_type=blob._read_meta().get("content_type"), metadata=blob._read_meta().get("metadata"))
+        return destination
+
+    def delete_blob(self, blob_name):
+        self.blob(blob_name).delete()
+
+    def list_blobs(self, prefix=None):
+        base = os.path.join(self.client.root, self.name)
+        blobs = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.startswith(".tmp-"):
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename), base).replace(os.sep, "/")
+                if prefix is None or name.startswith(prefix):
+                    blobs.append(self.get_blob(name))
+        return sorted((b for b in blobs if b is not None), key=lambda b: b.name)
+
+
+class Blob:
+    def __init__(self, name, bucket):
+        self.name = name
+        self.bucket = bucket
+        self.size = None
+        self.generation = None
+        self.metageneration = None
+        self.content_type = None
+        self.metadata = None
+        self.time_created = None
+        self.updated = None
+
+    def _path(self):
+        return self.bucket._object_path(self.name)
+
+    def _read_meta(self):
+        try:
+            with open(self.bucket._meta_path(self.name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _check_generation(self, if_generation_match):
+        if if_generation_match is None:
+            return
+        current = self._read_meta().get("generation", 0) if os.path.exists(self._path()) else 0
+        if current != if_generation_match:
+            raise PreconditionFailed(f"Generation mismatch for {self.name}: {current} != {if_generation_match}")
+
+    def _write(self, source, content_type=None, metadata=None, if_generation_match=None):
+        path = self._path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.getpid()}-{time.time_ns()}")
+        with open(tmp_path, "wb") as f:
+            if isinstance(source, bytes):
+                f.write(source)
+            elif isinstance(source, list):
+                for part_path in source:
+                    with open(part_path, "rb") as part:
+                        shutil.copyfileobj(part, f, 1024 * 1024)
+            else:
+                shutil.copyfileobj(source, f, 1024 * 1024)
+        with self.bucket._lock():
+            try:
+                self._check_generation(if_generation_match)
+            except PreconditionFailed:
+                os.remove(tmp_path)
+                raise
+            previous = self._read_meta() if os.path.exists(path) else {}
+            now = datetime.now(timezone.utc).isoformat()
+            meta = {
+                "generation": max(time.time_ns(), previous.get("generation", 0) + 1),
+                "metageneration": 1,
+                "content_type": content_type or "application/octet-stream",
+                "metadata": metadata,
+                "time_created": now,
+                "updated": now,
+            }
+            os.replace(tmp_path, path)
+            meta_path = self.bucket._meta_path(self.name)
+            os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+        self._apply_meta(meta, os.path.getsize(path))
+
+    def _apply_meta(self, meta, size):
+        self.size = size
+        self.generation = meta.get("generation")
+        self.metageneration = meta.get("metageneration")
+        self.content_type = meta.get("content_type")
+        self.metadata = meta.get("metadata")
+        self.time_created = datetime.fromisoformat(meta["time_created"]) if meta.get("time_created") else None
+        self.updated = datetime.fromisoformat(meta["updated"]) if meta.get("updated") else None
+
+    def exists(self):
+        return os.path.exists(self._path())
+
+    def reload(self):
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        self._apply_meta(self._read_meta(), os.path.getsize(self._path()))
+
+    def patch(self, if_generation_match=None, if_metageneration_match=None):
+        with self.bucket._lock():
+            if not self.exists():
+                raise NotFound(f"{self.bucket.name}/{self.name}")
+            self._check_generation(if_generation_match)
+            meta = self._read_meta()
+            if if_metageneration_match is not None and meta.get("metageneration") != if_metageneration_match:
+                raise PreconditionFailed(f"Metageneration mismatch for {self.name}: {meta.get('metageneration')} != {if_metageneration_match}")
+            meta["metadata"] = self.metadata
+            meta["metageneration"] = meta.get("metageneration", 1) + 1
+            meta["updated"] = datetime.now(timezone.utc).isoformat()
+            with open(self.bucket._meta_path(self.name), "w") as f:
+                json.dump(meta, f)
+        self._apply_meta(meta, os.path.getsize(self._path()))
+
+    def download_as_bytes(self, start=None, end=None, if_generation_match=None):
+        # Comme GCS, `end` est inclusif
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        self._check_generation(if_generation_match)
+        # Comme les en-têtes d'une lecture GCS, la génération lue est renseignée sur le blob
+        self.generation = self._read_meta().get("generation")
+        with open(self._path(), "rb") as f:
+            f.seek(start or 0)
+            if end is None:
+                return f.read()
+            return f.read(end - (start or 0) + 1)
+
+    def download_as_text(self, encoding="utf-8", **kwargs):
+        return self.download_as_bytes(**kwargs).decode(encoding)
+
+    def download_to_filename(self, filename, **kwargs):
+        if not self.exists():
+            raise NotFound(f"{self.bucket.name}/{self.name}")
+        self._check_generation(kwargs.get("if_generation_match"))
+        shutil.copyfile(self._path(), filename)
+
+    def upload_from_string(self, data, content_type="text/plain", if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self._write(data, content_type=content_type or self.content_type, metadata=self.metadata, if_generation_match=if_generation_match)
+
+    def upload_from_filename(self, filename, content_type=None, if_generation_match=None):
+        with open(filename, "rb") as f:
+            self._write(f, content_type=content_type or self.content_type, metadata=self.metadata, if_generation_match=if_generation_match)
+
+    def compose(self, sources, if_generation_match=None):
+        for source in sources:
+            if not source.exists():
+                raise NotFound(f"{source.bucket.name}/{source.name}")
+        self._write([source._path() for source in sources], content_type=self.content_type, metadata=self.metadata, if_generation_match=if_generation_match)
+
+    def delete(self, if_generation_match=None):
+        with self.bucket._lock():
+            if not self.exists():
+                raise NotFound(f"{self.bucket.name}/{self.name}")
+            self._check_generation(if_generation_match)
+            os.remove(self._path())
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self.bucket._meta_path(self.name))
@@ -0,0 +1,84 @@
+# cloud_functions/shared/local_warehouse.py
+"""SQLite stand-in for the BigQuery dataset used by the retail_data_pipeline DAG.
+
+Tables are created from the same schemas as the DAG and loaded from CSV
+objects of the storage backend (local storage when STORAGE_BACKEND=local).
+The database file defaults to LOCAL_WAREHOUSE_PATH.
+"""
+import csv
+import io
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from shared import compression
+from shared import storage_backend as storage
+
+SQLITE_TYPES = {
+    "STRING": "TEXT",
+    "TIMESTAMP": "TEXT",
+    "BOOLEAN": "INTEGER",
+    "FLOAT64": "REAL",
+    "INT64": "INTEGER",
+}
+
+
+class Warehouse:
+    def __init__(self, path=None):
+        self.path = os.path.abspath(path or os.getenv("LOCAL_WAREHOUSE_PATH", ".local_warehouse.db"))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.columns = {}
+        # Une seule écriture à la fois : SQLite verrouille la base entière
+        self._write_lock = threading.Lock()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def create_table(self, table, columns):
+        self.columns[table] = [name for name, _ in columns]
+        ddl = ", ".join(f"{name} {SQLITE_TYPES[col_type]}" for name, col_type in columns)
+        with self._write_lock, self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({ddl})")
+
+    def drop_column(self, table, column):
+        """Drop a column from an existing table if it still has it."""
+        with self._write_lock, self._connect() as conn:
+            existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if column in existing:
+                conn.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+
+    def drop_if_columns_differ(self, table, columns):
+        """Drop an existing table whose columns are not exactly `columns`, in order."""
+        with self._write_lock, self._connect() as conn:
+            existing = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+            if existing and existing != [name for name, _ in columns]:
+                conn.execute(f"DROP TABLE {table}")
+
+    def truncate(self, table):
+        with self._write_lock, self._connect() as conn:
+            conn.execute(f"DELETE FROM {table}")
+
+    def load_csv(self, table, bucket_name, path):
+        """Append a CSV object to a table, matching columns by header name; returns the row count."""
+        blob = storage.Client().bucket(bucket_name).blob(path)
+        data = compression.decompress_bytes(blob.download_as_bytes(), compression.compression_from_path(path))
+        reader = csv.DictReader(io.StringIO(data.decode("utf-8")))
+        file_name = path.rsplit("/", 1)[-1]
+        load_time = datetime.now(timezone.utc).isoformat()
+        columns = self.columns[table]
+        rows = []
+        for record in reader:
+            record = {k: (v if v != "" else None) for k, v in record.items()}
+            record["_file_name"] = file_name
+            record["_load_time"] = load_time
+            rows.append([record.get(name) for name in columns])
+        placeholders = ", ".join("?" for _ in columns)
+        with self._write_lock, self._connect() as conn:
+            conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        return len(rows)
+
+    def query(self, sql, params=()):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(sql, params)]
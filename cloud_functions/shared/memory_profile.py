@@ -0,0 +1,158 @@
+# cloud_functions/shared/memory_profile.py
+"""Per-invocation memory profiling and memory budget.
+
+With MEMORY_PROFILE=true, each checkpoint records the tracemalloc peak since
+the previous checkpoint plus the process RSS, and the profile is written to
+memory_profiles/<function>/ in the bucket at the end of the invocation.
+
+MEMORY_BUDGET_MB (or MEMORY_BUDGET_MB_<ENTITY>) is enforced whether or not
+profiling is on: callers ask `fits(step, projected_bytes, fallback)` before an
+in-memory step and take their `fallback` path (external sort-merge, fewer
+parallel shards, CSV serialized on disk) when the answer is no. start() and
+finish() bracket an invocation; finish() belongs in a finally block so that a
+failed invocation neither leaves tracemalloc running nor leaks its profile
+into the next one.
+"""
+import json
+import os
+import resource
+import time
+import tracemalloc
+from datetime import datetime
+
+# Empreinte d'un CSV chargé en mémoire (octets bruts + texte décodé + DataFrame à colonnes objet)
+IN_MEMORY_CSV_FACTOR = 4
+
+_current = None
+
+
+def profiling_enabled():
+    return os.getenv("MEMORY_PROFILE", "false").lower() == "true"
+
+
+def get_budget_bytes(entity=None):
+    """Memory budget in bytes (MEMORY_BUDGET_MB_<ENTITY>, then MEMORY_BUDGET_MB), or None when unset."""
+    value = os.getenv(f"MEMORY_BUDGET_MB_{entity.upper()}", "") if entity else ""
+    value = value or os.getenv("MEMORY_BUDGET_MB", "")
+    return int(float(value) * 1024 * 1024) if value else None
+
+
+def dataframe_csv_bytes(df):
+    """Projected footprint of serializing a DataFrame to CSV in memory (text, then encoded bytes)."""
+    return 2 * int(df.memory_usage(index=False, deep=True).sum())
+
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # Hors Linux : on se rabat sur le pic RSS du processus
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes():
+    # ru_maxrss est en kilo-octets sous Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class Profile:
+    def __init__(self, function_name, entity=None, source_file=None, enabled=None):
+        self.function_name = function_name
+        self.entity = entity
+        self.source_file = source_file
+        self.enabled = profiling_enabled() if enabled is None else enabled
+        self.budget_bytes = get_budget_bytes(entity)
+        self.started_at = datetime.utcnow()
+        self.steps = []
+        self.decisions = []
+        self._last = time.time()
+        # On n'arrête que le traçage démarré par ce profil
+        self.owns_tracing = self.enabled and not tracemalloc.is_tracing()
+        if self.owns_tracing:
+            tracemalloc.start()
+
+    def checkpoint(self, step):
+        """Record the memory used since the previous checkpoint under `step`."""
+        if not self.enabled:
+            return
+        now = time.time()
+        _, peak = tracemalloc.get_traced_memory() if tracemalloc.is_tracing() else (0, 0)
+        self.steps.append({
+            "step": step,
+            "duration_sec": round(now - self._last, 3),
+            "tracemalloc_peak_mb": round(peak / 1024 / 1024, 2),
+            "rss_mb": round(current_rss_bytes() / 1024 / 1024, 2),
+        })
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        self._last = now
+
+    def fits(self, step, projected_bytes, fallback="chunked"):
+        """Whether `projected_bytes` more memory stays within the budget (always True without a budget).
+
+        `fallback` names the path taken otherwise, as recorded in the profile.
+        """
+        if self.budget_bytes is None:
+            return True
+        rss = current_rss_bytes()
+        fits = rss + projected_bytes <= self.budget_bytes
+        self.decisions.append({
+            "step": step,
+            "rss_mb": round(rss / 1024 / 1024, 2),
+            "projected_mb": round(projected_bytes / 1024 / 1024, 2),
+            "budget_mb": round(self.budget_bytes / 1024 / 1024, 2),
+            "path": "in_memory" if fits else fallback,
+        })
+        return fits
+
+    def remaining_bytes(self):
+        if self.budget_bytes is None:
+            return None
+        return max(0, self.budget_bytes - current_rss_bytes())
+
+    def to_dict(self):
+        return {
+            "function": self.function_name,
+            "entity": self.entity,
+            "source_file": self.source_file,
+            "started_at": self.started_at.isoformat(),
+            "budget_mb": round(self.budget_bytes / 1024 / 1024, 2) if self.budget_bytes is not None else None,
+            "peak_rss_mb": round(peak_rss_bytes() / 1024 / 1024, 2),
+            "steps": self.steps,
+            "budget_decisions": self.decisions,
+        }
+
+    def write(self, bucket):
+        """Upload the profile as JSON; returns its path, or None when profiling is off."""
+        if not self.enabled:
+            return None
+        suffix = f"_{self.entity}" if self.entity else ""
+        path = f"memory_profiles/{self.function_name}/{self.started_at:%Y%m%d_%H%M%S_%f}{suffix}.json"
+        bucket.blob(path).upload_from_string(json.dumps(self.to_dict(), indent=2), "application/json")
+        return path
+
+    def stop(self):
+        if self.owns_tracing and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.owns_tracing = False
+
+
+def start(function_name, entity=None, source_file=None):
+    """Start the profile of the current invocation."""
+    global _current
+    _current = Profile(function_name, entity, source_file)
+    return _current
+
+
+def finish():
+    """End the current invocation: stop its tracing and forget its profile."""
+    global _current
+    if _current is not None:
+        _current.stop()
+    _current = None
+
+
+def current():
+    # Hors invocation démarrée par start() (tests, scripts), un profil éphémère lu depuis l'environnement
+    return _current if _current is not None else Profile("default", enabled=False)
@@ -0,0 +1,14 @@
+# cloud_functions/shared/storage_backend.py
+# Client de stockage utilisé par les fonctions : GCS par défaut,
+# système de fichiers local (shared/local_storage.py) si STORAGE_BACKEND=local.
+# Le choix est fait à chaque création de client, pas à l'import.
+import os
+
+from google.cloud import storage as gcs_storage
+
+from shared import local_storage
+
+def Client(*args, **kwargs):
+    if os.getenv("STORAGE_BACKEND", "gcs").lower() == "local":
+        return local_storage.Client(*args, **kwargs)
+    return gcs_storage.Client(*args, **kwargs)
@@ -0,0 +1,187 @@
+# cloud_functions/shared/transfer.py
+"""Large object transfers: concurrent ranged downloads and composite uploads.
+
+Objects up to one slice are transferred in a single request; downloads read
+the first slice before any metadata request, so a small object costs one
+round trip. Larger ones are downloaded as byte ranges in parallel, or
+uploaded as parts in parallel and composed into the destination object. Slice size and parallelism come from
+TRANSFER_SLICE_MB and TRANSFER_PARALLELISM unless given explicitly.
+"""
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import RequestRangeNotSatisfiable
+
+# Limite GCS du nombre de sources par appel compose
+MAX_COMPOSE_SOURCES = 32
+TMP_PREFIX = "_tmp/composite_uploads"
+
+
+def get_slice_size(slice_size=None):
+    if slice_size is not None:
+        return slice_size
+    return int(float(os.getenv("TRANSFER_SLICE_MB", "32")) * 1024 * 1024)
+
+
+def get_parallelism(parallelism=None):
+    if parallelism is not None:
+        return parallelism
+    return int(os.getenv("TRANSFER_PARALLELISM", "8"))
+
+
+def slice_ranges(size, slice_size):
+    """Inclusive (start, end) byte ranges covering an object of `size` bytes."""
+    return [(start, min(start + slice_size, size) - 1) for start in range(0, size, slice_size)]
+
+
+def _read_head(blob, slice_size):
+    """First slice of an object, read before any metadata request.
+
+    Returns (head, complete). An object shorter than one slice is then fully
+    transferred in a single request; otherwise its size is loaded and head is
+    None when the object was rewritten between the two requests.
+    """
+    try:
+        head = blob.download_as_bytes(start=0, end=slice_size - 1)
+    except RequestRangeNotSatisfiable:
+        # Objet vide : GCS refuse toute plage
+        return b"", True
+    if len(head) < slice_size:
+        return head, True
+    # La lecture renseigne la génération lue (en-tête x-goog-generation) : la suite est lue sur la même
+    head_generation = blob.generation
+    blob.reload()
+    if head_generation is None or str(head_generation) != str(blob.generation):
+        return None, False
+    return head, len(head) == blob.size
+
+
+def _download(blob, prepare, write_slice, slice_size, parallelism):
+    """Download an object larger than one slice through write_slice(start, data), after prepare(size).
+
+    Returns the whole content instead, without calling prepare, when a first
+    read shows the object fits in one slice. A blob whose metadata is already
+    loaded is not reloaded.
+    """
+    head = None
+    if blob.size is None or blob.generation is None:
+        head, complete = _read_head(blob, slice_size)
+        if complete:
+            return head
+    elif blob.size <= slice_size:
+        return blob.download_as_bytes(if_generation_match=blob.generation)
+    ranges = slice_ranges(blob.size, slice_size)
+    prepare(blob.size)
+    if head is not None:
+        write_slice(0, head)
+        ranges = ranges[1:]
+
+    # Toutes les tranches sont lues sur la même génération : un objet réécrit entre-temps fait échouer le transfert
+    def fetch(byte_range):
+        start, end = byte_range
+        write_slice(start, blob.download_as_bytes(start=start, end=end, if_generation_match=blob.generation))
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        list(executor.map(fetch, ranges))
+    return None
+
+
+def download_as_bytes(blob, slice_size=None, parallelism=None):
+    slice_size = get_slice_size(slice_size)
+    parallelism = get_parallelism(parallelism)
+    if parallelism <= 1:
+        return blob.download_as_bytes()
+    buffer = None
+
+    def prepare(size):
+        nonlocal buffer
+        buffer = bytearray(size)
+
+    def write_slice(start, data):
+        buffer[start:start + len(data)] = data
+
+    whole = _download(blob, prepare, write_slice, slice_size, parallelism)
+    return whole if whole is not None else buffer
+
+
+def download_to_filename(blob, filename, slice_size=None, parallelism=None):
+    slice_size = get_slice_size(slice_size)
+    parallelism = get_parallelism(parallelism)
+    if parallelism <= 1:
+        blob.download_to_filename(filename)
+        return
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        whole = _download(blob, lambda size: os.ftruncate(fd, size), lambda start, data: os.pwrite(fd, data, start), slice_size, parallelism)
+        if whole is not None:
+            os.write(fd, whole)
+    finally:
+        os.close(fd)
+
+
+def _compose(bucket, destination, parts, content_type, token):
+    # Compose par paliers de 32 sources jusqu'à obtenir l'objet final
+    level = 0
+    intermediates = []
+    while len(parts) > MAX_COMPOSE_SOURCES:
+        grouped = []
+        for n in range(0, len(parts), MAX_COMPOSE_SOURCES):
+            target = bucket.blob(f"{TMP_PREFIX}/{token}/compose-{level}-{n // MAX_COMPOSE_SOURCES:05d}")
+            target.content_type = content_type
+            target.compose(parts[n:n + MAX_COMPOSE_SOURCES])
+            grouped.append(target)
+        intermediates.extend(grouped)
+        parts = grouped
+        level += 1
+    destination.content_type = content_type
+    destination.compose(parts)
+    return intermediates
+
+
+def _upload_parts(bucket, path, read_part, size, content_type, slice_size, parallelism):
+    token = uuid.uuid4().hex
+    ranges = slice_ranges(size, slice_size)
+    parts = [bucket.blob(f"{TMP_PREFIX}/{token}/part-{n:05d}") for n in range(len(ranges))]
+
+    def upload(n):
+        start, end = ranges[n]
+        parts[n].upload_from_string(read_part(start, end - start + 1), "application/octet-stream")
+
+    intermediates = []
+    try:
+        with ThreadPoolExecutor(max_workers=parallelism) as executor:
+            list(executor.map(upload, range(len(parts))))
+        intermediates = _compose(bucket, bucket.blob(path), parts, content_type, token)
+    finally:
+        for blob in parts + intermediates:
+            try:
+                blob.delete()
+            except Exception:
+                pass
+
+
+def upload_from_string(bucket, path, data, content_type, slice_size=None, parallelism=None):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    slice_size = get_slice_size(slice_size)
+    parallelism = get_parallelism(parallelism)
+    if len(data) <= slice_size or parallelism <= 1:
+        bucket.blob(path).upload_from_string(data, content_type)
+        return
+    view = memoryview(data)
+    _upload_parts(bucket, path, lambda start, length: bytes(view[start:start + length]), len(data), content_type, slice_size, parallelism)
+
+
+def upload_from_filename(bucket, path, filename, content_type, slice_size=None, parallelism=None):
+    slice_size = get_slice_size(slice_size)
+    parallelism = get_parallelism(parallelism)
+    size = os.path.getsize(filename)
+    if size <= slice_size or parallelism <= 1:
+        bucket.blob(path).upload_from_filename(filename, content_type)
+        return
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        _upload_parts(bucket, path, lambda start, length: os.pread(fd, length, start), size, content_type, slice_size, parallelism)
+    finally:
+        os.close(fd)
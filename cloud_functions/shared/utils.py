@@ -1,24 +1,56 @@
 # cloud_functions/shared/utils.py
 import pandas as pd
-from google.cloud import storage
 import io
 import logging
 import json
+import os
+import tempfile
 from datetime import datetime
 
+from shared import compression, memory_profile, transfer
+from shared import storage_backend as storage
+
 def download_csv_from_gcs(bucket_name, blob_path):
     client = storage.Client()
     bucket = client.bucket(bucket_name)
     blob = bucket.blob(blob_path)
-    data = blob.download_as_text()
-    return pd.read_csv(io.StringIO(data))
+    data = compression.decompress_bytes(transfer.download_as_bytes(blob), compression.compression_from_path(blob_path))
+    return pd.read_csv(io.BytesIO(data))
 
 def upload_csv_to_gcs(df, bucket_name, blob_path):
+    """Upload a DataFrame as a CSV object, compressed according to the extension of blob_path.
+
+    Returns (bytes transferred, uncompressed bytes).
+    """
     client = storage.Client()
     bucket = client.bucket(bucket_name)
-    blob = bucket.blob(blob_path)
-    blob.upload_from_string(df.to_csv(index=False), 'text/csv')
-    logging.info(f"Uploaded to gs://{bucket_name}/{blob_path}")
+    # Sérialisation sur disque par morceaux si le CSV complet ne tient pas dans le budget mémoire
+    if not memory_profile.current().fits("upload", memory_profile.dataframe_csv_bytes(df), fallback="on_disk"):
+        transferred, raw = upload_csv_chunked(df, bucket, blob_path)
+        logging.info(f"Uploaded to gs://{bucket_name}/{blob_path} via a local file ({transferred} bytes transferred, {raw} bytes uncompressed)")
+        return transferred, raw
+    object_compression = compression.compression_from_path(blob_path)
+    data = df.to_csv(index=False).encode("utf-8")
+    payload = compression.compress_bytes(data, object_compression)
+    transfer.upload_from_string(bucket, blob_path, payload, compression.CONTENT_TYPES[object_compression])
+    logging.info(f"Uploaded to gs://{bucket_name}/{blob_path} ({len(payload)} bytes transferred, {len(data)} bytes uncompressed)")
+    return len(payload), len(data)
+
+def upload_csv_chunked(df, bucket, blob_path, rows_per_chunk=100000):
+    """Write a DataFrame to a local CSV chunk by chunk, then compress and upload it from disk.
+
+    Returns (bytes transferred, uncompressed bytes).
+    """
+    object_compression = compression.compression_from_path(blob_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_local = os.path.join(tmp_dir, "data.csv")
+        df.to_csv(csv_local, index=False, chunksize=rows_per_chunk)
+        upload_local = csv_local
+        if object_compression != "none":
+            upload_local = csv_local + compression.EXTENSIONS[object_compression]
+            compression.compress_file(csv_local, upload_local, object_compression)
+        transfer.upload_from_filename(bucket, blob_path, upload_local, compression.CONTENT_TYPES[object_compression])
+        return os.path.getsize(upload_local), os.path.getsize(csv_local)
 
 def move_blob(bucket_name, source_blob_name, destination_blob_name):
     client = storage.Client()
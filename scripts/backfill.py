@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# scripts/backfill.py
+"""Rebuild landing files and masters for a range of days.
+
+Generation of independent days runs in parallel (bounded by --workers);
+mastering stays sequential and in date order for each entity, while
+different entities are mastered side by side.
+
+Usage:
+    python scripts/backfill.py --start 2025-06-01 --end 2025-06-30
+    python scripts/backfill.py --start 2025-06-01 --end 2025-06-07 \
+        --entities customers,suppliers --local-root .local_storage
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime, timedelta
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(PROJECT_ROOT, "cloud_functions")
+
+# Entité -> (dossier de la Cloud Function, fonction de génération datée)
+GENERATORS = {
+    "customers": ("generate_customers_daily", "generate_and_upload_customers"),
+    "products": ("generate_products_daily", "generate_and_upload_products"),
+    "suppliers": ("generate_suppliers_daily", "generate_and_upload_suppliers"),
+}
+
+_modules = {}
+
+def load_function_module(function_dir):
+    # Chaque Cloud Function a son propre main.py : on les charge sous des noms distincts
+    if function_dir not in _modules:
+        source_dir = os.path.join(FUNCTIONS_DIR, function_dir)
+        for path in (FUNCTIONS_DIR, source_dir):
+            if path not in sys.path:
+                sys.path.insert(0, path)
+        spec = importlib.util.spec_from_file_location(f"{function_dir}_main", os.path.join(source_dir, "main.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[function_dir] = module
+    return _modules[function_dir]
+
+def landing_path(entity, day):
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    from shared import compression
+    return compression.csv_path(f"{entity}/{entity}_{day:%Y-%m-%d}", compression.get_compression(entity))
+
+def generate_day(entity, day, bucket_name):
+    function_dir, function_name = GENERATORS[entity]
+    start = time.time()
+    getattr(load_function_module(function_dir), function_name)(bucket_name, day)
+    return time.time() - start
+
+def master_day(entity, day):
+    # Même point d'entrée que l'événement GCS finalize
+    start = time.time()
+    message = load_function_module("consolidate_masters").main({"name": landing_path(entity, day)}, None)
+    return time.time() - start, message
+
+def date_range(start, end):
+    days = []
+    day = start
+    while day <= end:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def run_backfill(entities, days, bucket_name, workers):
+    """Generate then master every (entity, day); returns per (day, entity) timings."""
+    timings = {(day, entity): {} for day in days for entity in entities}
+    generated = set()
+    blocked = set()
+    next_day = {entity: 0 for entity in entities}
+    mastering = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as generate_pool, \
+            ProcessPoolExecutor(max_workers=len(entities)) as master_pool:
+        generating = {
+            generate_pool.submit(generate_day, entity, day, bucket_name): (day, entity)
+            for day in days for entity in entities
+        }
+        pending = set(generating)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in generating:
+                    day, entity = generating[future]
+                    try:
+                        timings[(day, entity)]["generate_sec"] = future.result()
+                        generated.add((day, entity))
+                    except Exception as e:
+                        timings[(day, entity)]["result"] = f"generation failed: {e}"
+                        blocked.add(entity)
+                else:
+                    day, entity = mastering.pop(future)
+                    try:
+                        timings[(day, entity)]["master_sec"], timings[(day, entity)]["result"] = future.result()
+                    except Exception as e:
+                        timings[(day, entity)]["result"] = f"mastering failed: {e}"
+                        blocked.add(entity)
+                    next_day[entity] += 1
+
+            # Un seul mastering en cours par entité, toujours le jour suivant dans l'ordre
+            in_flight = set(mastering.values())
+            for entity in entities:
+                if entity in blocked or next_day[entity] >= len(days):
+                    continue
+                day = days[next_day[entity]]
+                if (day, entity) in generated and (day, entity) not in in_flight:
+                    future = master_pool.submit(master_day, entity, day)
+                    mastering[future] = (day, entity)
+                    pending.add(future)
+    return timings
+
+def print_report(timings, days, entities, total_sec):
+    print(f"\n{'Day':<12}{'Entity':<12}{'Generate(s)':>12}{'Master(s)':>11}  Result")
+    for day in days:
+        day_total = 0.0
+        for entity in entities:
+            t = timings[(day, entity)]
+            day_total += t.get("generate_sec", 0.0) + t.get("master_sec", 0.0)
+            generate = f"{t['generate_sec']:.2f}" if "generate_sec" in t else "-"
+            master = f"{t['master_sec']:.2f}" if "master_sec" in t else "-"
+            print(f"{day:%Y-%m-%d}  {entity:<12}{generate:>12}{master:>11}  {t.get('result', 'not run')}")
+        print(f"{day:%Y-%m-%d}  {'(day total)':<12}{day_total:>23.2f}")
+    print(f"\nBackfilled {len(days)} day(s) x {len(entities)} entity(ies) in {total_sec:.2f} sec wall time")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill landing files and masters for a date range.")
+    parser.add_argument("--start", required=True, help="First day (YYYY-MM-DD)")
+    parser.add_argument("--end", required=True, help="Last day, inclusive (YYYY-MM-DD)")
+    parser.add_argument("--entities", default=",".join(GENERATORS), help="Comma-separated entities")
+    parser.add_argument("--bucket", default="retail-data-landing-zone")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Days generated in parallel")
+    parser.add_argument("--local-root", help="Use the local storage backend rooted at this directory")
+    parser.add_argument("--skip-bigquery", action="store_true", help="Do not load masters into BigQuery")
+    args = parser.parse_args(argv)
+
+    entities = [e.strip() for e in args.entities.split(",") if e.strip()]
+    unknown = [e for e in entities if e not in GENERATORS]
+    if unknown:
+        parser.error(f"Unknown entities: {', '.join(unknown)}")
+    days = date_range(datetime.strptime(args.start, "%Y-%m-%d").date(), datetime.strptime(args.end, "%Y-%m-%d").date())
+    if not days:
+        parser.error("--end must not be before --start")
+
+    # Configuration lue par les fonctions (et héritée par les processus de travail)
+    os.environ["RETAIL_DATA_LANDING_ZONE_BUCKET"] = args.bucket
+    if args.local_root:
+        os.environ["STORAGE_BACKEND"] = "local"
+        os.environ["LOCAL_STORAGE_ROOT"] = os.path.abspath(args.local_root)
+    if args.local_root or args.skip_bigquery:
+        os.environ["BIGQUERY_LOAD"] = "false"
+
+    start = time.time()
+    timings = run_backfill(entities, days, args.bucket, max(1, args.workers))
+    print_report(timings, days, entities, time.time() - start)
+    return timings
+
+if __name__ == "__main__":
+    main()
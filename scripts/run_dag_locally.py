@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+# scripts/run_dag_locally.py
+"""Run the retail_data_pipeline task graph in-process and report its critical path.
+
+Same tasks and dependencies as airflow/dags/retail_data_dag.py, executed
+against the local storage backend and a SQLite stand-in for BigQuery.
+Independent tasks run concurrently; at the end each task's start, duration
+and slack are printed along with the chain of tasks bounding the wall time.
+
+Usage:
+    python scripts/run_dag_locally.py --ds 2025-06-02 --local-root .local_storage
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPTS_DIR)
+for path in (SCRIPTS_DIR, os.path.join(PROJECT_ROOT, "cloud_functions"), os.path.join(PROJECT_ROOT, "airflow", "dags")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import backfill
+import retail_data_tasks as dag_tasks
+
+# Entités produites par la Cloud Function generate-data-function
+GENERATED_ENTITIES = ["customers", "products"]
+
+
+class SkipTask(Exception):
+    pass
+
+
+class LocalDagRun:
+    def __init__(self, ds, bucket_name, workers):
+        from shared import local_warehouse
+        self.ds = ds
+        self.bucket_name = bucket_name
+        self.workers = workers
+        self.warehouse = local_warehouse.Warehouse()
+
+    def _source_exists(self, source, **fields):
+        from shared import storage_backend as storage
+        path = source.format(ds=f"{self.ds:%Y-%m-%d}", **fields)
+        if not storage.Client().bucket(self.bucket_name).blob(path).exists():
+            raise SkipTask("source missing")
+        return path
+
+    def generate_synthetic_data(self):
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(GENERATED_ENTITIES))) as pool:
+            futures = [pool.submit(backfill.generate_day, entity, self.ds, self.bucket_name) for entity in GENERATED_ENTITIES]
+            for future in futures:
+                future.result()
+        return f"generated {', '.join(GENERATED_ENTITIES)}"
+
+    def create_bq_tables(self):
+        for table, column in dag_tasks.DROPPED_COLUMNS:
+            self.warehouse.drop_column(table, column)
+        for table, spec in dag_tasks.TABLES.items():
+            if table in dag_tasks.RECREATED_TABLES:
+                self.warehouse.drop_if_columns_differ(table, spec["columns"])
+            self.warehouse.create_table(table, spec["columns"])
+        return f"{len(dag_tasks.TABLES)} tables"
+
+    def load(self, table, source):
+        path = self._source_exists(source, ext=dag_tasks.landing_extension(table))
+        return f"{self.warehouse.load_csv(table, self.bucket_name, path)} rows"
+
+    def update_master_table(self):
+        if self.ds.weekday() != dag_tasks.MASTER_LOAD_WEEKDAY:
+            raise SkipTask("not a master load day")
+        table, source = dag_tasks.MASTER_LOAD
+        path = self._source_exists(source)
+        self.warehouse.truncate(table)
+        return f"{self.warehouse.load_csv(table, self.bucket_name, path)} rows"
+
+    def data_quality_checks(self):
+        selects = [
+            f"SELECT '{table}' AS table_name, COUNT(*) AS total_records,"
+            f" SUM({id_col} IS NULL) AS missing_ids, SUM({other_col} IS NULL) AS {other_alias}"
+            f" FROM {table} WHERE DATE(_load_time) = DATE('now')"
+            for table, id_col, other_col, other_alias in dag_tasks.QUALITY_CHECKS
+        ]
+        rows = [self.warehouse.query(sql)[0] for sql in selects]
+        return "; ".join(
+            f"{row['table_name']}: {row['total_records']} rows, " + ", ".join(
+                f"{key}={value or 0}" for key, value in row.items() if key.startswith("missing_"))
+            for row in rows
+        )
+
+    def task_callables(self):
+        callables = {
+            "generate_synthetic_data": self.generate_synthetic_data,
+            "create_bq_tables": self.create_bq_tables,
+            "update_master_table": self.update_master_table,
+            "data_quality_checks": self.data_quality_checks,
+        }
+        for task_id, (table, source) in dag_tasks.LOADS.items():
+            callables[task_id] = lambda table=table, source=source: self.load(table, source)
+        return callables
+
+
+def timed(func):
+    start = time.time()
+    try:
+        state, message = "success", func()
+    except SkipTask as e:
+        state, message = "skipped", str(e)
+    except Exception as e:
+        state, message = "failed", f"{type(e).__name__}: {e}"
+    return start, time.time(), state, message
+
+
+def run_graph(callables, dependencies):
+    """Run each task as soon as all its upstream tasks succeeded; returns per-task timings."""
+    results = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=len(callables)) as pool:
+        while len(results) < len(callables):
+            scheduled = True
+            while scheduled:
+                # Les échecs se propagent en cascade avant de lancer quoi que ce soit
+                scheduled = False
+                for task_id, upstream_ids in dependencies.items():
+                    if task_id in results or task_id in running.values():
+                        continue
+                    if any(results.get(u, {}).get("state") in ("failed", "upstream_failed") for u in upstream_ids):
+                        now = time.time()
+                        results[task_id] = {"start": now, "end": now, "state": "upstream_failed", "message": ""}
+                        scheduled = True
+                    elif all(u in results for u in upstream_ids):
+                        running[pool.submit(timed, callables[task_id])] = task_id
+                        scheduled = True
+            if not running:
+                break
+            # Attente bloquante jusqu'à la fin d'au moins une tâche
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                start, end, state, message = future.result()
+                results[running.pop(future)] = {"start": start, "end": end, "state": state, "message": message}
+    return results
+
+
+def critical_path(results, dependencies):
+    # On remonte depuis la dernière tâche terminée, via l'amont qui a fini le plus tard
+    task_id = max(results, key=lambda t: results[t]["end"])
+    chain = [task_id]
+    while dependencies[task_id]:
+        task_id = max(dependencies[task_id], key=lambda t: results[t]["end"])
+        chain.append(task_id)
+    return list(reversed(chain))
+
+
+def slack(results, dependencies):
+    """Time each task could have taken longer without delaying any downstream task or the run."""
+    run_end = max(r["end"] for r in results.values())
+    slacks = {}
+    for task_id, r in results.items():
+        downstream_starts = [results[t]["start"] for t, ups in dependencies.items() if task_id in ups]
+        slacks[task_id] = max(0.0, min(downstream_starts, default=run_end) - r["end"])
+    return slacks
+
+
+def print_report(results, dependencies, total_sec):
+    run_start = min(r["start"] for r in results.values())
+    slacks = slack(results, dependencies)
+    chain = critical_path(results, dependencies)
+    print(f"\n{'Task':<26}{'Start(s)':>9}{'Dur(s)':>9}{'End(s)':>9}{'Slack(s)':>10}  State")
+    for task_id in dependencies:
+        r = results[task_id]
+        marker = "*" if task_id in chain else " "
+        print(f"{marker}{task_id:<25}{r['start'] - run_start:>9.2f}{r['end'] - r['start']:>9.2f}"
+              f"{r['end'] - run_start:>9.2f}{slacks[task_id]:>10.2f}  {r['state']}"
+              + (f" ({r['message']})" if r["message"] else ""))
+    chain_sec = sum(results[t]["end"] - results[t]["start"] for t in chain)
+    print(f"\nCritical path: {' -> '.join(chain)}")
+    print(f"Critical path tasks: {chain_sec:.2f} sec of {total_sec:.2f} sec wall time "
+          f"({100 * chain_sec / total_sec if total_sec else 0:.0f}%)")
+    return chain
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the retail_data_pipeline DAG locally with a critical-path report.")
+    parser.add_argument("--ds", help="Execution date (YYYY-MM-DD), default: yesterday")
+    parser.add_argument("--bucket", default=dag_tasks.LANDING_BUCKET)
+    parser.add_argument("--local-root", default=".local_storage", help="Root of the local storage backend")
+    parser.add_argument("--warehouse", help="SQLite file standing in for BigQuery (default: <local-root>/warehouse.db)")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1), help="Generator processes")
+    args = parser.parse_args(argv)
+
+    ds = datetime.strptime(args.ds, "%Y-%m-%d").date() if args.ds else (datetime.utcnow() - timedelta(days=1)).date()
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["LOCAL_STORAGE_ROOT"] = os.path.abspath(args.local_root)
+    os.environ["LOCAL_WAREHOUSE_PATH"] = os.path.abspath(args.warehouse or os.path.join(args.local_root, "warehouse.db"))
+
+    start = time.time()
+    run = LocalDagRun(ds, args.bucket, max(1, args.workers))
+    results = run_graph(run.task_callables(), dag_tasks.TASK_DEPENDENCIES)
+    chain = print_report(results, dag_tasks.TASK_DEPENDENCIES, time.time() - start)
+    return results, chain
+
+
+if __name__ == "__main__":
+    main()
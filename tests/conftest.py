@@ -4,3 +4,45 @@ import os
 # Ajoute le projet root au PYTHONPATH
 project_root = os.path.dirname(os.path.dirname(__file__))
 sys.path.insert(0, project_root)
+
+# Modules partagés des Cloud Functions (importés via `from shared import ...`)
+sys.path.insert(0, os.path.join(project_root, 'cloud_functions'))
+
+import importlib.util
+
+import pytest
+
+from shared import local_storage
+
+
+@pytest.fixture
+def consolidate_main(tmp_path, monkeypatch):
+    """consolidate_masters/main.py loaded against a local storage root in tmp_path."""
+    monkeypatch.setenv("RETAIL_DATA_LANDING_ZONE_BUCKET", "retail-data-landing-zone")
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path))
+    monkeypatch.syspath_prepend(os.path.join(project_root, 'cloud_functions', 'consolidate_masters'))
+    spec = importlib.util.spec_from_file_location("consolidate_main", os.path.join(project_root, 'cloud_functions', 'consolidate_masters', 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def object_reads(monkeypatch):
+    """(object name, start, end) of every read of a local storage object, in order."""
+    reads = []
+    download_as_bytes = local_storage.Blob.download_as_bytes
+    download_to_filename = local_storage.Blob.download_to_filename
+
+    def tracked_as_bytes(self, start=None, end=None, **kwargs):
+        reads.append((self.name, start, end))
+        return download_as_bytes(self, start=start, end=end, **kwargs)
+
+    def tracked_to_filename(self, filename, **kwargs):
+        reads.append((self.name, None, None))
+        return download_to_filename(self, filename, **kwargs)
+
+    monkeypatch.setattr(local_storage.Blob, "download_as_bytes", tracked_as_bytes)
+    monkeypatch.setattr(local_storage.Blob, "download_to_filename", tracked_to_filename)
+    return reads
@@ -0,0 +1,22 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath('scripts'))
+
+import backfill
+
+def test_backfill_against_local_storage(tmp_path, monkeypatch):
+    """Two days of suppliers are generated and mastered in date order on the local backend."""
+    for var in ("STORAGE_BACKEND", "LOCAL_STORAGE_ROOT", "BIGQUERY_LOAD", "RETAIL_DATA_LANDING_ZONE_BUCKET"):
+        monkeypatch.setenv(var, "")
+    timings = backfill.main([
+        '--start', '2025-06-02', '--end', '2025-06-03', '--entities', 'suppliers',
+        '--local-root', str(tmp_path), '--workers', '2',
+    ])
+
+    results = [timings[(day, 'suppliers')]['result'] for day in sorted(d for d, _ in timings)]
+    assert results == ["Mastering suppliers: created", "Mastering suppliers: mastered"]
+    bucket_dir = tmp_path / 'retail-data-landing-zone'
+    assert (bucket_dir / 'suppliers' / 'suppliers_2025-06-02.csv').exists()
+    assert (bucket_dir / 'master' / 'suppliers' / 'suppliers_master.csv').exists()
+    assert len(list((bucket_dir / 'master' / 'suppliers' / 'history').iterdir())) == 1
@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from shared import local_storage
+
+def test_redelivered_event_is_skipped_before_any_download(consolidate_main, object_reads, monkeypatch):
+    """A second delivery of the same object generation does no work; a new generation is mastered again."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    consolidate = consolidate_main
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    path = "customers/customers_2025-06-02.csv"
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000001,A\nC000002,B\n", "text/csv")
+    generation = bucket.get_blob(path).generation
+
+    assert consolidate.main({"name": path, "generation": str(generation)}, None) == "Mastering customers: created"
+    entry = json.loads(bucket.blob(f"_ledger/consolidate_masters/{path}/{generation}.json").download_as_text())
+    assert entry["status"] == "done" and entry["action"] == "created"
+
+    object_reads.clear()
+    assert consolidate.main({"name": path}, None) == "Skipped customers: duplicate event (done)"
+    assert path not in [name for name, _, _ in object_reads]
+
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000001,A2\nC000002,B\n", "text/csv")
+    assert consolidate.main({"name": path}, None) == "Mastering customers: mastered"
+
+def test_concurrent_claims(consolidate_main, monkeypatch):
+    """Only one delivery owns an event; a released or stale claim can be taken again."""
+    ledger = consolidate_main.event_ledger
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+
+    claim, entry = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert claim is not None
+    other, current = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert other is None and current["status"] == "in_progress"
+    assert ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 8)[0] is not None
+
+    ledger.release(claim)
+    claim, entry = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert claim is not None
+
+    # Instance arrêtée en cours de traitement : la réclamation expirée est reprise, une seule fois
+    monkeypatch.setenv("LEDGER_CLAIM_TIMEOUT_SEC", "0")
+    taken, entry = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert taken is not None and entry["taken_over_from"]
+    ledger.complete(taken, entry, {"action": "mastered"})
+    other, current = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert other is None and current["status"] == "done" and current["action"] == "mastered"
+    # Le propriétaire initial, dépossédé, ne peut plus écraser l'entrée
+    ledger.release(claim)
+    assert bucket.get_blob(taken.name) is not None
+
+def test_claim_retries_an_entry_that_vanishes(consolidate_main, monkeypatch):
+    """An entry deleted or rewritten between the refused write and its read is read again, a bounded number of times."""
+    ledger = consolidate_main.event_ledger
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    write = ledger._write
+
+    # Réclamation libérée juste après avoir fait échouer la nôtre
+    refused = []
+    def released_meanwhile(blob, entry, if_generation_match):
+        if not refused:
+            refused.append(blob.name)
+            raise PreconditionFailed("held by another delivery")
+        return write(blob, entry, if_generation_match)
+    monkeypatch.setattr(ledger, "_write", released_meanwhile)
+    assert ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)[0] is not None
+
+    # Entrée remplacée pendant sa lecture
+    monkeypatch.setattr(ledger, "_write", write)
+    download_as_text = local_storage.Blob.download_as_text
+    replaced = []
+    def replaced_meanwhile(self, **kwargs):
+        if not replaced:
+            replaced.append(self.name)
+            raise NotFound(self.name)
+        return download_as_text(self, **kwargs)
+    monkeypatch.setattr(local_storage.Blob, "download_as_text", replaced_meanwhile)
+    other, current = ledger.claim(bucket, "consolidate_masters", "customers/c.csv", 7)
+    assert other is None and current["status"] == "in_progress" and replaced
+
+    def always_refused(blob, entry, if_generation_match):
+        raise PreconditionFailed("held by another delivery")
+    monkeypatch.setattr(ledger, "_write", always_refused)
+    assert ledger.claim(bucket, "consolidate_masters", "customers/d.csv", 7) == (None, {"status": "contended", "object": "customers/d.csv", "generation": "7"})
+
+def test_claim_is_settled_when_post_processing_fails(consolidate_main, monkeypatch):
+    """A failure after the claim, audit log included, still completes or releases the ledger entry."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    path = "customers/customers_2025-06-02.csv"
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000001,A\n", "text/csv")
+    generation = bucket.get_blob(path).generation
+    entry_path = f"_ledger/consolidate_masters/{path}/{generation}.json"
+
+    def failing(*args, **kwargs):
+        raise RuntimeError("failed")
+    monkeypatch.setattr(consolidate_main, "log_audit", failing)
+    with pytest.raises(RuntimeError):
+        consolidate_main.main({"name": path}, None)
+    # Le master est publié : l'événement est traité, une nouvelle livraison est ignorée
+    assert json.loads(bucket.blob(entry_path).download_as_text())["status"] == "done"
+
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000001,B\n", "text/csv")
+    monkeypatch.setattr(consolidate_main, "process_mastering", failing)
+    with pytest.raises(RuntimeError):
+        consolidate_main.main({"name": path}, None)
+    assert bucket.get_blob(f"_ledger/consolidate_masters/{path}/{bucket.get_blob(path).generation}.json") is None
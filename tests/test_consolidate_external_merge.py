@@ -0,0 +1,30 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import external_merge
+
+def test_external_sort_merge_spills_runs_and_counts_changes(tmp_path, monkeypatch):
+    """Small runs and fan-in force several spill and merge passes."""
+    monkeypatch.setattr(external_merge, 'MAX_MERGE_FANIN', 2)
+    old = pd.DataFrame({'product_id': [f"P{str(i).zfill(5)}" for i in range(5000, 0, -1)], 'price': '10.0'})
+    new = old[old['product_id'] != 'P00042'].copy()
+    new.loc[new['product_id'] == 'P00007', 'price'] = '12.5'
+    new = pd.concat([new, pd.DataFrame({'product_id': ['P09999'], 'price': ['3.0']})])
+    old.to_csv(tmp_path / "old.csv", index=False)
+    new.to_csv(tmp_path / "new.csv", index=False)
+
+    out_path = tmp_path / "master.csv"
+    counts = external_merge.external_sort_merge(
+        tmp_path / "new.csv", tmp_path / "old.csv", 'product_id', out_path, 16 * 1024, tmp_path
+    )
+
+    assert counts['inserted'] == 1
+    assert counts['updated'] == 1
+    assert counts['deleted'] == 1
+    assert counts['rows'] == len(new)
+    master = pd.read_csv(out_path, dtype=str)
+    assert master['product_id'].is_monotonic_increasing
+    assert sorted(master['product_id']) == sorted(new['product_id'])
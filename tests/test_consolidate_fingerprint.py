@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+from shared import local_storage
+
+def test_fingerprint_is_reused_until_the_object_changes(consolidate_main, object_reads):
+    """The hash is stored on the object and trusted only for the generation it was computed for."""
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    path = "customers/customers_2025-06-02.csv"
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000002,B\nC000001,A\n", "text/csv")
+    downloads = lambda: [name for name, _, _ in object_reads]
+
+    first = consolidate_main.get_file_hash("retail-data-landing-zone", path)
+    assert downloads() == [path]
+    assert bucket.get_blob(path).metadata[consolidate_main.FINGERPRINT_KEY] == first
+    assert consolidate_main.get_file_hash("retail-data-landing-zone", path) == first
+    assert downloads() == [path]
+
+    # Même contenu réécrit, métadonnées comprises : la génération ne correspond plus, on re-hache
+    stale = bucket.get_blob(path)
+    rewritten = bucket.blob(path)
+    rewritten.metadata = stale.metadata
+    rewritten.upload_from_string("customer_id,company_name\nC000001,A\nC000002,B\n", "text/csv")
+    assert consolidate_main.get_file_hash("retail-data-landing-zone", path) == first
+    assert downloads() == [path, path]
+
+@pytest.mark.parametrize("setting, value", [("MASTER_MEMORY_CAP_MB", "0.0001"), ("MASTER_NUM_SHARDS", "2")])
+def test_identical_file_is_skipped_before_any_merge(consolidate_main, monkeypatch, setting, value):
+    """Out-of-core and sharded masters carry the landing fingerprint, compared before dispatch."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    monkeypatch.setenv(setting, value)
+    consolidate = consolidate_main
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    bucket.blob("customers/customers_2025-06-02.csv").upload_from_string("customer_id,company_name\nC000001,A\nC000002,B\n", "text/csv")
+    assert consolidate.main({"name": "customers/customers_2025-06-02.csv"}, None) == "Mastering customers: created"
+    if setting == "MASTER_NUM_SHARDS":
+        assert json.loads(bucket.blob("master/customers/customers_master_manifest.json").download_as_text())["fingerprint"]
+    else:
+        assert consolidate.read_fingerprint(bucket.get_blob("master/customers/customers_master.csv"))
+
+    def no_merge(*args, **kwargs):
+        raise AssertionError("identical file merged")
+    monkeypatch.setattr(consolidate.external_merge, "external_sort_merge", no_merge)
+    monkeypatch.setattr(consolidate, "run_shard_merges", no_merge)
+    bucket.blob("customers/customers_2025-06-03.csv").upload_from_string("customer_id,company_name\nC000002,B\nC000001,A\n", "text/csv")
+    assert consolidate.main({"name": "customers/customers_2025-06-03.csv"}, None) == "Mastering customers: unchanged"
+
+def test_redelivered_file_is_not_downloaded(consolidate_main, monkeypatch, object_reads):
+    """A landing object whose stored fingerprint matches the master is skipped without reading it."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    path = "customers/customers_2025-06-02.csv"
+    bucket.blob(path).upload_from_string("customer_id,company_name\nC000001,A\nC000002,B\n", "text/csv")
+    assert consolidate_main.main({"name": path}, None) == "Mastering customers: created"
+    assert consolidate_main.read_fingerprint(bucket.get_blob(path))
+
+    object_reads.clear()
+    assert consolidate_main.process_mastering("customers", path, "customer_id")["action"] == "unchanged"
+    assert path not in [name for name, _, _ in object_reads]
@@ -0,0 +1,45 @@
+import gzip
+import io
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import key_index
+import master_lookup
+from shared import local_storage
+
+def test_lookups_read_only_sidecars_and_needed_row_groups(monkeypatch, tmp_path, object_reads):
+    """A gzip master written as row groups stays a valid gzip CSV and serves point lookups by range."""
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path))
+    lines = ["customer_id,company_name\n"] + [f'C{i:06d},"Company {i}, Inc"\n' for i in range(1000)]
+    body = io.BytesIO()
+    index, bloom = key_index.write_indexed(io.StringIO("".join(lines)), "customer_id", body, "gzip", row_group_rows=64)
+    assert gzip.decompress(body.getvalue()).decode() == "".join(lines)
+    assert len(index["row_groups"]) == 16 and index["rows"] == 1000
+    assert all(f"C{i:06d}" in bloom for i in range(1000))
+
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    path = "master/customers/customers_master.csv.gz"
+    blob = bucket.blob(path)
+    blob.upload_from_string(body.getvalue(), "application/gzip")
+    blob.metadata = key_index.upload_sidecars(bucket, path, index, bloom, page_keys=100)
+    blob.patch()
+    index_path = blob.metadata["key_index"]
+    assert key_index.load_index(bucket, index_path)["num_pages"] == 10
+
+    assert master_lookup.contains("customers", ["C000007", "C999999"], "retail-data-landing-zone") == {"C000007": True, "C999999": False}
+    assert all(name != path for name, _, _ in object_reads)
+    # Seule la page de la clé positive au filtre de Bloom est lue
+    pages = [name for name, _, _ in object_reads if name.startswith(key_index.page_prefix(index_path))]
+    assert pages == [key_index.page_path(index_path, key_index.page_of("C000007", 10))]
+
+    records = master_lookup.get_records("customers", ["C000007", "C000900", "C999999"], "retail-data-landing-zone")
+    assert records == {
+        "C000007": {"customer_id": "C000007", "company_name": "Company 7, Inc"},
+        "C000900": {"customer_id": "C000900", "company_name": "Company 900, Inc"},
+    }
+    body_reads = [(start, end) for name, start, end in object_reads if name == path]
+    assert len(body_reads) == 2 and all(start is not None for start, _ in body_reads)
+    assert len(master_lookup.master_keys(bucket, "customers", "customer_id")) == 1000
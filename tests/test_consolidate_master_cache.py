@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pandas as pd
+
+from shared import local_storage
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import master_cache
+
+def test_cache_checks_generation_and_evicts_least_recently_used():
+    df = pd.DataFrame({'customer_id': [f"C{i}" for i in range(1000)], 'country': ['France', 'Spain'] * 500})
+    size = int(master_cache.encode(df).memory_usage(index=True, deep=True).sum())
+    cache = master_cache.MasterCache(max_bytes=2 * size)
+
+    assert cache.put('customers', 'master/customers/customers_master.csv', 1, df)
+    assert cache.put('products', 'master/products/products_master.csv', 1, df)
+    assert cache.get('customers', 'master/customers/customers_master.csv', 2) is None
+    # Entrée rendue encodée, sans copie : mêmes valeurs que la lecture en chaînes
+    hit = cache.get('customers', 'master/customers/customers_master.csv', 1)
+    assert isinstance(hit['country'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(hit.astype(object), df)
+
+    # Products est le moins récemment utilisé : c'est lui qui sort
+    assert cache.put('suppliers', 'master/suppliers/suppliers_master.csv', 1, df)
+    assert cache.get('products', 'master/products/products_master.csv', 1) is None
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert cache.size_bytes <= cache.max_bytes
+
+    # Budget mémoire serré : les autres entités sortent d'abord, rien n'est ajouté au-delà du reste disponible
+    assert cache.evict(1, keep='suppliers') == size
+    assert list(cache.entries) == [('suppliers', 'master/suppliers/suppliers_master.csv', 1)]
+    assert not cache.put('products', 'master/products/products_master.csv', 2, df, available_bytes=size - 1)
+
+def test_warm_instance_reuses_published_master(tmp_path, consolidate_main, object_reads, monkeypatch):
+    """The master published by one invocation is served from memory to the next, until it is rewritten."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    monkeypatch.setattr(master_cache, "_cache", None)
+    consolidate = consolidate_main
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    master_path = "master/customers/customers_master.csv"
+    downloads = lambda: [name for name, _, _ in object_reads]
+
+    for day, name in [(2, 'A'), (3, 'B'), (4, 'C')]:
+        if day == 4:
+            # Master réécrit hors de cette instance : nouvelle génération, l'entrée n'est plus valide
+            bucket.blob(master_path).upload_from_string((tmp_path / "retail-data-landing-zone" / master_path).read_bytes(), "text/csv")
+        path = f"customers/customers_2025-06-0{day}.csv"
+        bucket.blob(path).upload_from_string(f"customer_id,company_name\nC000001,{name}\nC000002,X\n", "text/csv")
+        consolidate.main({"name": path}, None)
+        if day == 3:
+            assert master_path not in downloads()
+
+    assert master_path in downloads()
+    cache = master_cache.current()
+    assert (cache.hits, cache.misses) == (1, 1)
+    step_log = pd.read_csv(tmp_path / "retail-data-landing-zone/master/customers/audit/step_log.csv")
+    messages = step_log[step_log["step"] == "master_cache"]["message"].tolist()
+    assert [message.split(" ")[0] for message in messages] == ["Cached", "Hit", "Cached", "Miss", "Cached"]
+    assert "hits=1 misses=1" in messages[-1]
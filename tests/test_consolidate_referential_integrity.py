@@ -0,0 +1,32 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import referential_integrity
+
+def test_validate_csv_counts_samples_and_quarantines_orphans(tmp_path):
+    """Orphaned references are found chunk by chunk, per column, and every orphaned row is quarantined."""
+    orders = pd.DataFrame({
+        'order_id': [f"O{i:04d}" for i in range(10)],
+        'customer_id': ['C1', 'C2', 'C9', 'C1', '', 'C2', 'C3', 'C1', 'C2', 'C3'],
+        'product_id': ['P1', 'P1', 'P1', 'P7', 'P2', 'P2', 'P2', 'P1', 'P9', 'P1'],
+    })
+    source = tmp_path / "orders.csv"
+    orders.to_csv(source, index=False)
+    keys = {
+        'customer_id': np.unique(np.array(['C3', 'C1', 'C2'])),
+        'product_id': np.unique(np.array(['P2', 'P1'])),
+    }
+    quarantine = tmp_path / "orphans.csv"
+
+    report = referential_integrity.validate_csv(source, keys, sample_size=2, quarantine_path=quarantine, chunk_rows=3)
+
+    assert report['rows'] == 10
+    assert report['orphans_by_column'] == {'customer_id': 2, 'product_id': 2}
+    assert report['orphan_rows'] == 4
+    assert [row['order_id'] for row in report['sample']] == ['O0002', 'O0003']
+    assert report['sample'][1]['missing_references'] == ['product_id']
+    assert pd.read_csv(quarantine, dtype=str)['order_id'].tolist() == ['O0002', 'O0003', 'O0004', 'O0008']
@@ -0,0 +1,58 @@
+import io
+import os
+import sys
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import sharding
+import master_lookup
+from shared import local_storage
+
+def test_partition_csv_is_stable_and_complete(tmp_path):
+    """Every row lands in exactly one shard, always the same one for a given key."""
+    df = pd.DataFrame({
+        'customer_id': [f"C{str(i).zfill(6)}" for i in range(500)],
+        'company_name': [f"Company {i}" for i in range(500)],
+    })
+    source = tmp_path / "landing.csv"
+    df.to_csv(source, index=False)
+
+    paths, rows = sharding.partition_csv([source], 'customer_id', 4, tmp_path)
+    assert rows == 500
+    parts = [pd.read_csv(p, dtype=str) for p in paths]
+    assert sum(len(p) for p in parts) == 500
+    for i, part in enumerate(parts):
+        assert (sharding.shard_ids(part['customer_id'], 4) == i).all()
+
+def test_compare_shards_counts_changes():
+    old = pd.DataFrame({'customer_id': ['C1', 'C2', 'C3'], 'city': ['Paris', 'Lyon', 'Nice']})
+    new = pd.DataFrame({'customer_id': ['C1', 'C2', 'C4'], 'city': ['Paris', 'Lille', 'Nice']})
+    assert sharding.compare_shards(old, new, 'customer_id') == {'inserted': 1, 'updated': 1, 'deleted': 1}
+
+def test_sharding_can_be_turned_on_and_off(consolidate_main, monkeypatch):
+    """Switching layouts archives the previous master and keeps diffing against its content."""
+    monkeypatch.setenv("BIGQUERY_LOAD", "false")
+    bucket = local_storage.Client().bucket("retail-data-landing-zone")
+    manifest_path = "master/customers/customers_master_manifest.json"
+    master_path = "master/customers/customers_master.csv"
+
+    def deliver(day, body):
+        bucket.blob(f"customers/customers_{day}.csv").upload_from_string("customer_id,company_name\n" + body, "text/csv")
+        return consolidate_main.main({"name": f"customers/customers_{day}.csv"}, None)
+
+    assert deliver("2025-06-02", "C1,A\nC2,B\n") == "Mastering customers: created"
+    monkeypatch.setenv("MASTER_NUM_SHARDS", "2")
+    assert deliver("2025-06-03", "C1,A2\nC2,B\n") == "Mastering customers: mastered"
+    assert not bucket.blob(master_path).exists()
+
+    monkeypatch.setenv("MASTER_NUM_SHARDS", "1")
+    assert deliver("2025-06-04", "C1,A3\nC2,B\nC3,C\n") == "Mastering customers: mastered"
+    assert not bucket.blob(manifest_path).exists()
+    history = [blob.name for blob in bucket.list_blobs(prefix="master/customers/history/")]
+    assert any(name.endswith(".json") for name in history)
+    master = pd.read_csv(io.BytesIO(bucket.blob(master_path).download_as_bytes()), dtype=str).set_index("customer_id")
+    assert master.loc["C1", "change_count"] == "2"
+    assert master.loc["C2", "change_count"] == "0"
+    records = master_lookup.get_records("customers", ["C1", "C3"], "retail-data-landing-zone")
+    assert {key: row["company_name"] for key, row in records.items()} == {"C1": "A3", "C3": "C"}
@@ -14,6 +14,7 @@ def test_generate_initial_b2b_customers():
     for col in [
         'customer_id', 'company_name', 'vat_number', 'address', 'postal_code',
         'city', 'country', 'currency', 'email', 'phone', 'industry', 'created_at',
-        'last_modified', 'customer_segment', 'is_active', 'modification_history'
+        'last_modified', 'customer_segment', 'is_active'
     ]:
         assert col in df.columns
+    assert 'modification_history' not in df.columns
@@ -16,9 +16,10 @@ def test_generate_suppliers():
     expected_columns = [
         'supplier_id', 'company_name', 'service_type', 'address', 'postal_code',
         'city', 'country', 'email', 'phone', 'created_at', 'last_modified',
-        'is_active', 'modification_history'
+        'is_active'
     ]
     for col in expected_columns:
         assert col in df.columns
+    assert 'modification_history' not in df.columns
     
     print(f"✅ Suppliers test passed: {len(df)} rows generated")
@@ -0,0 +1,68 @@
+import csv
+import json
+import os
+import sys
+
+import pandas as pd
+
+from shared import changelog, local_storage
+
+sys.path.insert(0, os.path.abspath('cloud_functions/consolidate_masters'))
+
+import external_merge
+
+def test_diff_frames_and_change_counts():
+    old = pd.DataFrame({'customer_id': ['C1', 'C2', 'C3'], 'city': ['Paris', 'Lyon', 'Nice'],
+                        'name': ['a', 'b', 'c'], 'last_modified': ['d1', 'd1', 'd1'], 'change_count': ['0', '4', '1']})
+    new = pd.DataFrame({'customer_id': ['C1', 'C2', 'C4'], 'city': ['Paris', 'Lille', 'Nice'],
+                        'name': ['a', 'B', 'd'], 'last_modified': ['d1', 'd2', 'd2']})
+
+    changes = changelog.diff_frames(old, new, 'customer_id', '2025-06-03T00:00:00', 'customers/customers_2025-06-03.csv')
+
+    assert list(changes.columns) == changelog.COLUMNS
+    assert sorted(zip(changes['key'], changes['field'], changes['old'], changes['new'])) == [
+        ('C2', 'city', 'Lyon', 'Lille'), ('C2', 'name', 'b', 'B')
+    ]
+    counts = changelog.with_change_counts(new, old, 'customer_id', changes)
+    assert dict(zip(counts['customer_id'], counts['change_count'])) == {'C1': 0, 'C2': 6, 'C4': 0}
+
+def test_change_log_objects_follow_the_landing_file():
+    """Backfilled files go to their own day partition and never share an object within a second."""
+    assert changelog.partition_day('customers/customers_2025-06-02.csv.gz', '2026-10-19T08:00:00') == '2025-06-02'
+    assert changelog.partition_day('customers/latest.csv', '2026-10-19T08:00:00') == '2026-10-19'
+    assert {changelog.changes_name(f'customers/customers_2025-06-0{day}.csv.gz', '20261019_080000') for day in (2, 3)} == \
+        {'customers_2025-06-02_changes_20261019_080000', 'customers_2025-06-03_changes_20261019_080000'}
+
+def test_history_json_rebuilds_per_key_view(tmp_path):
+    bucket = local_storage.Client(root=str(tmp_path)).bucket('b')
+    for day, ts, old, new in [('2025-06-02', '2025-06-02T10:00:00', 'Paris', 'Lyon'), ('2025-06-03', '2025-06-03T10:00:00', 'Lyon', 'Nice')]:
+        changes = pd.DataFrame([['C1', 'city', old, new, ts, f'customers/customers_{day}.csv']], columns=changelog.COLUMNS)
+        assert changelog.write_changes(bucket, 'customers', changes, day, f'customers_changes_{day}') == \
+            f'changelog/customers/date={day}/customers_changes_{day}.csv'
+    assert changelog.write_changes(bucket, 'customers', changes.iloc[0:0], '2025-06-04', 'empty') is None
+
+    assert len(changelog.read_changes(bucket, 'customers', start_day='2025-06-03')) == 1
+    history = changelog.history_json(bucket, 'customers')
+    assert json.loads(history['C1']) == [
+        {'date': '2025-06-02T10:00:00', 'field': 'city', 'old': 'Paris', 'new': 'Lyon'},
+        {'date': '2025-06-03T10:00:00', 'field': 'city', 'old': 'Lyon', 'new': 'Nice'},
+    ]
+
+def test_external_sort_merge_logs_field_changes(tmp_path):
+    """The previous master's change_count is not a difference, and is carried over on the merged rows."""
+    old = pd.DataFrame({'product_id': ['P1', 'P2', 'P3'], 'price': ['1.0', '2.0', '3.0'], 'change_count': ['2', '0', '0']})
+    new = pd.DataFrame({'product_id': ['P1', 'P2'], 'price': ['1.5', '2.0']})
+    old.to_csv(tmp_path / 'old.csv', index=False)
+    new.to_csv(tmp_path / 'new.csv', index=False)
+
+    counts = external_merge.external_sort_merge(
+        tmp_path / 'new.csv', tmp_path / 'old.csv', 'product_id', tmp_path / 'master.csv', 16 * 1024, tmp_path,
+        tmp_path / 'changes.csv', '2025-06-03T00:00:00', 'products/products_2025-06-03.csv'
+    )
+
+    assert counts['updated'] == 1 and counts['deleted'] == 1 and not counts['columns_changed']
+    assert counts['field_changes'] == 1
+    master = pd.read_csv(tmp_path / 'master.csv', dtype=str)
+    assert dict(zip(master['product_id'], master['change_count'])) == {'P1': '3', 'P2': '0'}
+    with open(tmp_path / 'changes.csv', newline='') as f:
+        assert list(csv.reader(f))[1] == ['P1', 'price', '1.0', '1.5', '2025-06-03T00:00:00', 'products/products_2025-06-03.csv']
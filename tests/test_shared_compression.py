@@ -0,0 +1,27 @@
+import pytest
+
+from shared import compression
+
+@pytest.mark.parametrize("codec", ["none", "gzip", "zstd"])
+def test_compression_round_trip(tmp_path, codec):
+    """Bytes and local files come back identical whatever the codec."""
+    data = ("customer_id,city\n" + "".join(f"C{i},Paris\n" for i in range(1000))).encode()
+    assert compression.decompress_bytes(compression.compress_bytes(data, codec), codec) == data
+
+    src = tmp_path / "master.csv"
+    src.write_bytes(data)
+    packed = tmp_path / ("master.csv" + compression.EXTENSIONS[codec] + ".tmp")
+    compression.compress_file(src, packed, codec)
+    out = tmp_path / "out.csv"
+    assert compression.decompress_file(packed, out, codec) == len(data)
+    assert out.read_bytes() == data
+
+def test_object_names_follow_compression(monkeypatch):
+    monkeypatch.setenv("OBJECT_COMPRESSION", "gzip")
+    monkeypatch.setenv("OBJECT_COMPRESSION_SUPPLIERS", "zstd")
+    assert compression.csv_path("customers/customers_2025-01-01", compression.get_compression("customers")) == "customers/customers_2025-01-01.csv.gz"
+    assert compression.compression_from_path("suppliers/suppliers_2025-01-01.csv.zst") == "zstd"
+    assert compression.get_compression("suppliers") == "zstd"
+    assert compression.split_extension("customers_master.csv.gz") == ("customers_master", ".csv.gz")
+    assert compression.is_csv_object("products/products_2025-01-01.csv")
+    assert not compression.is_csv_object("master/products/audit/audit_log.jsonl")
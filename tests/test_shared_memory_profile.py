@@ -0,0 +1,57 @@
+import csv
+import importlib.util
+import json
+import os
+import tracemalloc
+from datetime import date
+
+import pytest
+
+from shared import compression, local_storage, memory_profile
+
+def test_profiled_generation_serializes_on_disk_over_budget(tmp_path, monkeypatch):
+    """With a budget below the process RSS, the CSV is serialized on disk and the profile records every step."""
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path))
+    monkeypatch.setenv("OBJECT_COMPRESSION", "gzip")
+    monkeypatch.setenv("MEMORY_PROFILE", "true")
+    monkeypatch.setenv("MEMORY_BUDGET_MB_SUPPLIERS", "1")
+    monkeypatch.setattr(memory_profile, "_current", None)
+    main_path = os.path.join(os.getcwd(), 'cloud_functions', 'generate_suppliers_daily', 'main.py')
+    spec = importlib.util.spec_from_file_location("suppliers_main", main_path)
+    suppliers_main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(suppliers_main)
+
+    suppliers_main.generate_and_upload_suppliers("retail-data-landing-zone", date(2025, 6, 2))
+
+    bucket = local_storage.Client(root=str(tmp_path)).bucket("retail-data-landing-zone")
+    landing = tmp_path / "landing.csv"
+    bucket.blob("suppliers/suppliers_2025-06-02.csv.gz").download_to_filename(str(landing) + ".gz")
+    compression.decompress_file(str(landing) + ".gz", landing, "gzip")
+    with open(landing, newline="") as f:
+        assert len(list(csv.DictReader(f))) == 500
+
+    [profile_blob] = bucket.list_blobs(prefix="memory_profiles/generate_suppliers_daily/")
+    profile = json.loads(profile_blob.download_as_text())
+    assert [step["step"] for step in profile["steps"]] == ["generate", "upload"]
+    assert all(step["rss_mb"] > 0 for step in profile["steps"])
+    assert profile["budget_decisions"][0]["path"] == "on_disk"
+    assert not tracemalloc.is_tracing() and memory_profile._current is None
+
+def test_failed_invocation_stops_tracing(tmp_path, monkeypatch):
+    """A generator that raises still stops tracemalloc and drops its profile."""
+    monkeypatch.setenv("STORAGE_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_STORAGE_ROOT", str(tmp_path))
+    monkeypatch.setenv("MEMORY_PROFILE", "true")
+    monkeypatch.setattr(memory_profile, "_current", None)
+    main_path = os.path.join(os.getcwd(), 'cloud_functions', 'generate_products_daily', 'main.py')
+    spec = importlib.util.spec_from_file_location("products_main", main_path)
+    products_main = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(products_main)
+    def failing_upload(*args, **kwargs):
+        raise RuntimeError("upload failed")
+    monkeypatch.setattr(products_main.utils, "upload_csv_to_gcs", failing_upload)
+
+    with pytest.raises(RuntimeError):
+        products_main.generate_and_upload_products("retail-data-landing-zone", date(2025, 6, 2))
+    assert not tracemalloc.is_tracing() and memory_profile._current is None
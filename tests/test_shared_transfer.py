@@ -0,0 +1,46 @@
+import os
+
+from shared import local_storage, transfer
+
+def test_sliced_download_and_composite_upload(tmp_path, monkeypatch):
+    """Transfers split into slices and parts rebuild the exact object."""
+    monkeypatch.setattr(transfer, 'MAX_COMPOSE_SOURCES', 4)
+    bucket = local_storage.Client(root=str(tmp_path / "gcs")).bucket("retail-data-landing-zone")
+    data = os.urandom(100_000)
+
+    transfer.upload_from_string(bucket, "master/customers/customers_master.csv.gz", data, "application/gzip", slice_size=4096, parallelism=4)
+    blob = bucket.get_blob("master/customers/customers_master.csv.gz")
+    assert blob.size == len(data)
+    assert blob.content_type == "application/gzip"
+    assert [b.name for b in bucket.list_blobs(prefix=transfer.TMP_PREFIX)] == []
+
+    assert transfer.download_as_bytes(bucket.blob(blob.name), slice_size=3000, parallelism=4) == data
+    target = tmp_path / "master.csv.gz"
+    transfer.download_to_filename(bucket.blob(blob.name), target, slice_size=3000, parallelism=4)
+    assert target.read_bytes() == data
+
+    source = tmp_path / "landing.csv"
+    source.write_bytes(data[:10_000])
+    transfer.upload_from_filename(bucket, "customers/customers_2025-01-01.csv", source, "text/csv", slice_size=1000, parallelism=3)
+    assert bucket.blob("customers/customers_2025-01-01.csv").download_as_bytes(start=1000, end=1999) == data[1000:2000]
+
+def test_small_download_takes_one_request(tmp_path, monkeypatch):
+    """An object shorter than one slice is read without any metadata request; a large one is reloaded once."""
+    bucket = local_storage.Client(root=str(tmp_path)).bucket("retail-data-landing-zone")
+    bucket.blob("customers/small.csv").upload_from_string(b"customer_id\nC1\n", "text/csv")
+    bucket.blob("customers/large.csv").upload_from_string(os.urandom(10_000), "text/csv")
+    bucket.blob("customers/empty.csv").upload_from_string(b"", "text/csv")
+    reloads = []
+    reload = local_storage.Blob.reload
+    monkeypatch.setattr(local_storage.Blob, "reload", lambda self: (reloads.append(self.name), reload(self)))
+
+    assert transfer.download_as_bytes(bucket.blob("customers/small.csv"), slice_size=1000, parallelism=4) == b"customer_id\nC1\n"
+    assert transfer.download_as_bytes(bucket.blob("customers/empty.csv"), slice_size=1000, parallelism=4) == b""
+    target = tmp_path / "small.csv"
+    transfer.download_to_filename(bucket.blob("customers/small.csv"), target, slice_size=1000, parallelism=4)
+    assert target.read_bytes() == b"customer_id\nC1\n"
+    assert reloads == []
+
+    data = bucket.blob("customers/large.csv").download_as_bytes()
+    assert transfer.download_as_bytes(bucket.blob("customers/large.csv"), slice_size=1000, parallelism=4) == data
+    assert reloads == ["customers/large.csv"]